@@ -3,14 +3,21 @@ ASGI config for LittleLemon project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+See LittleLemon/startup.py for the startup profiling and warm-up switches.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+from LittleLemon import startup
+
+startup.profile_imports()
+
+from django.core.asgi import get_asgi_application  # noqa: E402
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LittleLemon.settings')
 
-application = get_asgi_application()
+application = startup.instrument_asgi(get_asgi_application())
+startup.warm_up_if_enabled()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,16 +45,69 @@ INSTALLED_APPS = [
     "djoser",
 ]
 
+# The Lean* middleware are Django's, skipped for requests that don't need them
+# (see LEAN_MIDDLEWARE_PATHS)
 MIDDLEWARE = [
+    "LittleLemonAPI.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "LittleLemonAPI.middleware.AdmissionControlMiddleware",
+    "LittleLemonAPI.middleware.SlowQueryMiddleware",
+    "LittleLemonAPI.middleware.CompressionMiddleware",
+    "LittleLemonAPI.middleware.LeanSessionMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
-    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "LittleLemonAPI.middleware.LeanCsrfViewMiddleware",
+    "LittleLemonAPI.middleware.LeanAuthenticationMiddleware",
+    "LittleLemonAPI.middleware.LeanMessageMiddleware",
+    "LittleLemonAPI.middleware.LeanXFrameOptionsMiddleware",
 ]
 
+# Token-authenticated or cookieless requests to these paths skip the session,
+# CSRF, authentication, messages and clickjacking middleware
+LEAN_MIDDLEWARE_PATHS = ["/api/", "/auth/token/"]
+
+# Concurrent requests admitted per class of routes (by URL name, optionally
+# prefixed with the method) and the seconds a request may wait for a slot
+# before it is answered with 503 and Retry-After. Cheap catalog reads get the
+# most slots so expensive staff views and checkouts can't starve them.
+ADMISSION_CLASSES = {
+    "catalog": {
+        "routes": [
+            "GET categories",
+            "GET menu-items",
+            "GET menu-item",
+            "autocomplete",
+        ],
+        "limit": 32,
+        "timeout": 1,
+    },
+    "checkout": {
+        "routes": ["cart", "POST orders"],
+        "limit": 8,
+        "timeout": 2,
+        "retry_after": 2,
+    },
+    "orders": {
+        "routes": ["home", "orders", "order"],
+        "limit": 8,
+        "timeout": 1,
+    },
+    "staff": {
+        "routes": [
+            "categories",
+            "menu-items",
+            "menu-item",
+            "item-of-day",
+            "managers",
+            "manager",
+            "delivery-crew",
+            "delivery-crew-member",
+        ],
+        "limit": 2,
+        "timeout": 0.5,
+        "retry_after": 5,
+    },
+}
+
 ROOT_URLCONF = "LittleLemon.urls"
 
 TEMPLATES = [
@@ -82,9 +136,41 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            # Writers take the lock when their transaction begins, and readers
+            # don't block them (see LittleLemonAPI/writes.py)
+            "transaction_mode": "IMMEDIATE",
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL",
+        },
     }
 }
 
+# Writes that find the database locked are retried this many times, waiting
+# about WRITE_RETRY_BACKOFF seconds, doubled on each attempt
+WRITE_RETRY_ATTEMPTS = 8
+WRITE_RETRY_BACKOFF = 0.01
+# Commit writes in batches of up to WRITER_LANE_BATCH_SIZE from one thread
+SQLITE_WRITER_LANE = False
+WRITER_LANE_BATCH_SIZE = 32
+# Seconds a write may wait in the lane before it is dropped and answered with 503
+WRITER_LANE_TIMEOUT = 5
+
+# Log statements taking at least SLOW_QUERY_THRESHOLD seconds, with their
+# query plans, to SLOW_QUERY_LOG_FILE (see `python manage.py slow_queries`)
+SLOW_QUERY_LOG = False
+SLOW_QUERY_THRESHOLD = 0.1
+SLOW_QUERY_LOG_FILE = BASE_DIR / "slow_queries.jsonl"
+
+# Directory shared by the worker processes where each writes its metrics every
+# METRICS_FLUSH_INTERVAL seconds, so /metrics reports all of them. Only this
+# process is reported when unset. The processes must run on the same host.
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5
+# /metrics answers METRICS_ALLOWED_IPS only, and only staff users or scrapers
+# sending "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+METRICS_TOKEN = None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -127,6 +213,8 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+MSGPACK = find_spec("msgpack") is not None
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.TokenAuthentication",
@@ -137,18 +225,90 @@ REST_FRAMEWORK = {
         "rest_framework.filters.OrderingFilter",
         "rest_framework.filters.SearchFilter",
     ],
+    # MessagePack is offered when msgpack is installed and the browsable API
+    # only while debugging
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+        *(["LittleLemonAPI.parsers.MessagePackParser"] if MSGPACK else []),
+    ],
     "DEFAULT_RENDERER_CLASSES": [
-        "rest_framework.renderers.JSONRenderer",
-        "rest_framework.renderers.BrowsableAPIRenderer",
+        "LittleLemonAPI.renderers.FastJSONRenderer",
+        *(["LittleLemonAPI.renderers.MessagePackRenderer"] if MSGPACK else []),
+        *(["rest_framework.renderers.BrowsableAPIRenderer"] if DEBUG else []),
     ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 4,
     "DEFAULT_THROTTLE_RATES": {
         "anon": "5/minute",
         "user": "10/minute",
+        "autocomplete": "120/minute",
     },
 }
 
+# API responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+
+# Coordinate identical concurrent reads between processes through a lock in
+# the cache, sharing results through the cache for this many seconds
+COALESCE_ACROSS_PROCESSES = False
+COALESCE_RESULT_TTL = 1
+
+# Seconds the serialized categories and featured menu items are cached for
+# (see LittleLemonAPI/catalog.py)
+CATALOG_CACHE_TTL = 300
+
+# Seconds between checks of whether other processes changed the titles the
+# autocomplete index is built from (see LittleLemonAPI/autocomplete.py)
+AUTOCOMPLETE_VERSION_CHECK = 1
+
+# Functions run by the LITTLELEMON_WARMUP warm-up (see LittleLemon/startup.py)
+STARTUP_WARMUPS = [
+    "LittleLemonAPI.catalog.prime",
+    "LittleLemonAPI.autocomplete.prime",
+]
+
+# Startup profiling and warm-up reports go to stderr
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "LittleLemon.startup": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
+# Where carts are kept until checkout: the Cart table, or
+# "LittleLemonAPI.carts.CacheCartStore" to keep them in the CART_CACHE cache
+# for CART_TTL seconds after their last change
+CART_STORAGE = "LittleLemonAPI.carts.DatabaseCartStore"
+CART_CACHE = "default"
+CART_TTL = 60 * 60 * 24
+
+# Background jobs (see LittleLemonAPI/jobs.py): seconds a claimed job is hidden
+# from other workers, attempts before a job is marked failed, and the base and
+# maximum seconds between attempts
+JOB_LEASE = 60
+JOB_MAX_ATTEMPTS = 5
+JOB_BACKOFF = 2
+JOB_MAX_BACKOFF = 60 * 60
+
+# Idempotency keys (see LittleLemonAPI/idempotency.py): seconds responses are
+# kept for replay, seconds before the claim of a request that died expires,
+# and seconds a retry waits for the request it repeats
+IDEMPOTENCY_TTL = 60 * 60 * 24
+IDEMPOTENCY_LEASE = 30
+IDEMPOTENCY_WAIT = 10
+
+# Counters the daily stock of each limited menu item is split across, so that
+# concurrent checkouts update different rows (see LittleLemonAPI/inventory.py)
+INVENTORY_SHARDS = 8
+
+# Receipts are printed until a mail server is configured
+EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+DEFAULT_FROM_EMAIL = "orders@littlelemon.example"
+
 
 DJOSER = {
     "USER_ID_FIELD": "username",
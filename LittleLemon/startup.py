@@ -0,0 +1,218 @@
+"""
+Cold start instrumentation and warm-up for the WSGI/ASGI entry points.
+
+Setting LITTLELEMON_PROFILE_STARTUP=1 reports the time spent importing each
+module and the time to the first response once that response is sent. Reports
+are logged by the "LittleLemon.startup" logger.
+
+Setting LITTLELEMON_WARMUP=1 runs `warm_up` when the application is created.
+With a pre-forking server that loads the application in the master (e.g.
+`gunicorn --preload`), this happens once before the workers are forked, so
+they start with populated URL resolvers, model metadata and caches.
+"""
+
+import logging
+import os
+import sys
+import time
+
+PROFILE_ENV = "LITTLELEMON_PROFILE_STARTUP"
+WARMUP_ENV = "LITTLELEMON_WARMUP"
+
+START = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+
+def enabled(name: str) -> bool:
+    return os.environ.get(name, "").lower() in ["1", "true", "yes"]
+
+
+class ImportTimer:
+    """
+    Meta path finder that times the execution of every module imported while
+    it is installed, both on its own and including the modules it imports.
+    """
+
+    def __init__(self):
+        self.times: dict[str, tuple[float, float]] = {}
+        self.stack: list[float] = []
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        # Class-level loaders (builtins, frozen modules) are shared, so only
+        # loader instances are wrapped, and only once
+        loader = spec.loader
+        if (
+            loader is None
+            or isinstance(loader, type)
+            or not hasattr(loader, "exec_module")
+            or getattr(loader, "import_timer", None) is self
+        ):
+            return spec
+
+        exec_module = loader.exec_module
+
+        def timed_exec_module(module):
+            self.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = self.stack.pop()
+                self.times[module.__name__] = (elapsed - children, elapsed)
+                if self.stack:
+                    self.stack[-1] += elapsed
+
+        loader.exec_module = timed_exec_module
+        loader.import_timer = self
+        return spec
+
+    def report(self, limit: int = 25) -> str:
+        total = sum(own for own, _ in self.times.values())
+        lines = [
+            f"imported {len(self.times)} modules in {total * 1000:.1f}ms",
+            f"{'self ms':>9} {'total ms':>9}  module",
+        ]
+        ranked = sorted(self.times.items(), key=lambda item: -item[1][1])
+        for name, (own, cumulative) in ranked[:limit]:
+            lines.append(f"{own * 1000:>9.1f} {cumulative * 1000:>9.1f}  {name}")
+        return "\n".join(lines)
+
+
+import_timer = ImportTimer()
+
+
+def profile_imports():
+    """Start timing imports if startup profiling is enabled"""
+    if enabled(PROFILE_ENV):
+        import_timer.install()
+
+
+def report_first_response():
+    import_timer.uninstall()
+    elapsed = time.perf_counter() - START
+    logger.info(import_timer.report())
+    logger.info("first response after %.1fms", elapsed * 1000)
+
+
+def instrument_wsgi(application):
+    """Report startup timings after the first response, if enabled"""
+    if not enabled(PROFILE_ENV):
+        return application
+
+    pending = [True]
+
+    def wrapper(environ, start_response):
+        response = application(environ, start_response)
+        if pending:
+            pending.clear()
+            report_first_response()
+        return response
+
+    return wrapper
+
+
+def instrument_asgi(application):
+    """Report startup timings after the first response, if enabled"""
+    if not enabled(PROFILE_ENV):
+        return application
+
+    pending = [True]
+
+    async def wrapper(scope, receive, send):
+        await application(scope, receive, send)
+        if pending and scope["type"] == "http":
+            pending.clear()
+            report_first_response()
+
+    return wrapper
+
+
+def iter_patterns(resolver):
+    for pattern in resolver.url_patterns:
+        yield pattern
+        if hasattr(pattern, "url_patterns"):
+            yield from iter_patterns(pattern)
+
+
+def warm_up():
+    """
+    Do the work a worker would otherwise do on its first requests: compile the
+    URL patterns, load the DRF settings, build every serializer's fields (which
+    also fills the models' metadata caches) and run the functions listed in
+    the STARTUP_WARMUPS setting, e.g. to prime caches.
+    """
+    from django.conf import settings
+    from django.db import connections
+    from django.urls import get_resolver
+    from django.utils.module_loading import import_string
+    from rest_framework.settings import api_settings
+
+    from LittleLemonAPI import serializers
+
+    # The resolver's lookup tables and each pattern's regex are built on
+    # first access, which is all that is wanted of them here
+    resolver = get_resolver()
+    reverse_dict = resolver.reverse_dict
+    regexes = [pattern.pattern.regex for pattern in iter_patterns(resolver)]
+    logger.info(
+        "compiled %d URL patterns, %d reversible", len(regexes), len(reverse_dict)
+    )
+
+    for setting in [
+        "DEFAULT_AUTHENTICATION_CLASSES",
+        "DEFAULT_FILTER_BACKENDS",
+        "DEFAULT_PAGINATION_CLASS",
+        "DEFAULT_PARSER_CLASSES",
+        "DEFAULT_PERMISSION_CLASSES",
+        "DEFAULT_RENDERER_CLASSES",
+        "DEFAULT_THROTTLE_CLASSES",
+    ]:
+        getattr(api_settings, setting)
+
+    for serializer_class in vars(serializers).values():
+        if (
+            isinstance(serializer_class, type)
+            and issubclass(serializer_class, serializers.serializers.ModelSerializer)
+            and serializer_class.__module__ == serializers.__name__
+        ):
+            build_fields(serializer_class())
+
+    for warmup in getattr(settings, "STARTUP_WARMUPS", []):
+        import_string(warmup)()
+
+    # Forked workers must not share the master's database connections
+    connections.close_all()
+
+
+def build_fields(serializer):
+    for field in serializer.fields.values():
+        if hasattr(field, "child"):
+            field = field.child
+        if hasattr(field, "fields"):
+            build_fields(field)
+
+
+def warm_up_if_enabled():
+    if enabled(WARMUP_ENV):
+        start = time.perf_counter()
+        warm_up()
+        elapsed = time.perf_counter() - start
+        logger.info("warmed up in %.1fms", elapsed * 1000)
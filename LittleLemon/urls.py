@@ -19,6 +19,8 @@ from django.contrib import admin
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from LittleLemonAPI.views import metrics_view
+
 router = DefaultRouter(trailing_slash=False)
 
 urlpatterns = [
@@ -26,4 +28,5 @@ urlpatterns = [
     path("api/", include("LittleLemonAPI.urls")),
     path("auth/", include("djoser.urls")),
     path("auth/", include("djoser.urls.authtoken")),
+    path("metrics", metrics_view, name="metrics"),
 ]
@@ -3,14 +3,21 @@ WSGI config for LittleLemon project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
 
+See LittleLemon/startup.py for the startup profiling and warm-up switches.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/wsgi/
 """
 
 import os
 
-from django.core.wsgi import get_wsgi_application
+from LittleLemon import startup
+
+startup.profile_imports()
+
+from django.core.wsgi import get_wsgi_application  # noqa: E402
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LittleLemon.settings')
 
-application = get_wsgi_application()
+application = startup.instrument_wsgi(get_wsgi_application())
+startup.warm_up_if_enabled()
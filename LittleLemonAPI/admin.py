@@ -1,10 +1,115 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import OperationalError, connections
+from django.utils.functional import cached_property
 
-from . import models
+from . import jobs, models
 
-# Register your models here.
-admin.site.register(models.Cart)
-admin.site.register(models.Category)
-admin.site.register(models.MenuItem)
-admin.site.register(models.Order)
-admin.site.register(models.OrderItem)
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that estimates the size of large unfiltered tables instead of
+    running `COUNT(*)`, which has to visit every row.
+
+    The planner statistics of PostgreSQL and SQLite (`sqlite_stat1`, which
+    `ANALYZE` fills in) are used as the estimate. Filtered querysets, tables
+    estimated below `exact_below` rows, tables not analyzed yet and other
+    databases are counted exactly.
+    """
+
+    exact_below = 10_000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimate = estimate_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and estimate >= self.exact_below:
+                return estimate
+        return super().count
+
+
+def estimate_count(model, using: str) -> int | None:
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [table])
+            row = cursor.fetchone()
+        elif connection.vendor == "sqlite":
+            try:
+                # One row per index, each starting with the table's row count
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+            except OperationalError:
+                # sqlite_stat1 is created by the first ANALYZE
+                return None
+            row = cursor.fetchone()
+            if row is not None:
+                row = (int(row[0].split()[0]),)
+        else:
+            return None
+
+    # PostgreSQL reports -1 for tables that were never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(models.Category)
+class CategoryAdmin(ScalableModelAdmin):
+    list_display = ["title", "slug"]
+    search_fields = ["title"]
+
+
+@admin.register(models.MenuItem)
+class MenuItemAdmin(ScalableModelAdmin):
+    list_display = ["title", "price", "featured", "category", "daily_limit"]
+    list_select_related = ["category"]
+    list_filter = ["featured", "category"]
+    search_fields = ["title"]
+    autocomplete_fields = ["category"]
+
+
+@admin.register(models.Cart)
+class CartAdmin(ScalableModelAdmin):
+    list_display = ["id", "user", "menuitem", "quantity", "price"]
+    list_select_related = ["user", "menuitem"]
+    search_fields = ["=user__username"]
+    autocomplete_fields = ["menuitem"]
+    raw_id_fields = ["user"]
+
+
+@admin.register(models.Order)
+class OrderAdmin(ScalableModelAdmin):
+    list_display = ["id", "user", "delivery_crew", "status", "total", "date"]
+    list_select_related = ["user", "delivery_crew"]
+    list_filter = ["status", "date"]
+    search_fields = ["=id", "=user__username"]
+    raw_id_fields = ["user", "delivery_crew"]
+
+
+@admin.register(models.OrderItem)
+class OrderItemAdmin(ScalableModelAdmin):
+    list_display = ["id", "order", "title", "category_title", "quantity", "price"]
+    list_select_related = ["order__user"]
+    search_fields = ["=order__id"]
+    autocomplete_fields = ["menuitem"]
+    raw_id_fields = ["order"]
+
+
+@admin.register(models.Job)
+class JobAdmin(ScalableModelAdmin):
+    list_display = ["id", "task", "status", "attempts", "run_at"]
+    list_filter = ["status", "task"]
+    search_fields = ["=key"]
+    actions = ["retry"]
+
+    @admin.action(description="Retry selected failed jobs")
+    def retry(self, request, queryset):
+        retried = jobs.retry(queryset)
+        self.message_user(request, f"{retried} failed jobs will run again")
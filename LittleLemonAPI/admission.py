@@ -0,0 +1,129 @@
+"""
+Admission control for the API routes.
+
+ADMISSION_CLASSES sorts routes, by URL name, into classes that each admit at
+most `limit` requests at a time. Requests beyond that wait up to `timeout`
+seconds for a slot and are then shed, so an overloaded class fails fast
+instead of slowing down the others. A route can be listed as "METHOD name",
+which takes precedence over the bare name, so reads and writes of the same
+URL can belong to different classes. Unlisted routes are not limited.
+
+The counts are per process.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import counter_family, gauge_family, registry
+
+
+class Gate:
+    def __init__(self, name: str, limit: int, timeout: float, retry_after: int = 1):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {"admitted": 0, "shed": 0}
+
+    def acquire(self) -> bool:
+        """Wait up to `timeout` seconds for a slot, returning whether one was taken"""
+        with self.condition:
+            self.waiting += 1
+            try:
+                admitted = self.condition.wait_for(
+                    lambda: self.in_flight < self.limit, self.timeout
+                )
+            finally:
+                self.waiting -= 1
+            if admitted:
+                self.in_flight += 1
+            self.stats["admitted" if admitted else "shed"] += 1
+            return admitted
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def snapshot(self) -> dict:
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                **self.stats,
+            }
+
+
+class Admission:
+    def __init__(self, classes: dict):
+        self.gates: dict[str, Gate] = {}
+        self.routes: dict[str, Gate] = {}
+        for name, options in classes.items():
+            options = dict(options)
+            routes = options.pop("routes")
+            gate = self.gates[name] = Gate(name, **options)
+            for route in routes:
+                self.routes[route] = gate
+
+    def gate(self, method: str, url_name: str | None) -> Gate | None:
+        if url_name is None:
+            return None
+        if method == "HEAD":
+            method = "GET"
+        return self.routes.get(f"{method} {url_name}") or self.routes.get(url_name)
+
+    def snapshot(self) -> dict:
+        return {name: gate.snapshot() for name, gate in self.gates.items()}
+
+
+_admission = None
+_lock = threading.Lock()
+
+
+def get_admission() -> Admission:
+    global _admission
+    admission = _admission
+    if admission is None:
+        with _lock:
+            if _admission is None:
+                _admission = Admission(getattr(settings, "ADMISSION_CLASSES", {}))
+            admission = _admission
+    return admission
+
+
+@receiver(setting_changed)
+def reset_admission(setting, **kwargs):
+    global _admission
+    if setting == "ADMISSION_CLASSES":
+        with _lock:
+            _admission = None
+
+
+def collect_metrics() -> dict:
+    snapshot = get_admission().snapshot()
+    families = {}
+    for family, key, description in [
+        (gauge_family, "in_flight", "Requests being handled"),
+        (gauge_family, "waiting", "Requests waiting for a slot"),
+        (counter_family, "admitted", "Requests admitted"),
+        (counter_family, "shed", "Requests rejected with 503"),
+    ]:
+        name = f"littlelemon_admission_{key}"
+        if family is counter_family:
+            name += "_total"
+        families[name] = family(
+            f"{description}, by admission class",
+            ["class"],
+            [[[gate], counts[key]] for gate, counts in snapshot.items()],
+        )
+    return families
+
+
+registry.collectors.append(collect_metrics)
@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class LittlelemonapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'LittleLemonAPI'
+
+    def ready(self):
+        # Connected here so that menu writes made outside the API (the shell,
+        # loaddata, management commands) are seen too
+        from . import autocomplete, catalog
+        from .models import Category, MenuItem
+
+        for model in [MenuItem, Category]:
+            post_save.connect(catalog.invalidate_on_write, sender=model)
+            post_delete.connect(catalog.invalidate_on_write, sender=model)
+            post_save.connect(autocomplete.index_saved, sender=model)
+            post_delete.connect(autocomplete.unindex_deleted, sender=model)
@@ -0,0 +1,53 @@
+import datetime as dt
+
+from django.db import transaction
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+
+def archivable_orders(cutoff: dt.date):
+    """Delivered orders placed before `cutoff`"""
+    return Order.objects.filter(status=True, date__lt=cutoff).order_by("id")
+
+
+def archive_batch(cutoff: dt.date, batch_size: int) -> int:
+    """
+    Move up to `batch_size` archivable orders and their items into the archive
+    tables in a single transaction, returning the number of orders moved.
+    """
+    with transaction.atomic():
+        orders = list(archivable_orders(cutoff)[:batch_size])
+        if not orders:
+            return 0
+
+        ids = [order.id for order in orders]
+        items = list(OrderItem.objects.filter(order_id__in=ids))
+
+        ArchivedOrder.objects.bulk_create(
+            ArchivedOrder(
+                id=order.id,
+                user_id=order.user_id,
+                delivery_crew_id=order.delivery_crew_id,
+                status=order.status,
+                total=order.total,
+                date=order.date,
+            )
+            for order in orders
+        )
+        ArchivedOrderItem.objects.bulk_create(
+            ArchivedOrderItem(
+                id=item.id,
+                order_id=item.order_id,
+                menuitem_id=item.menuitem_id,
+                title=item.title,
+                category_title=item.category_title,
+                quantity=item.quantity,
+                unit_price=item.unit_price,
+                price=item.price,
+            )
+            for item in items
+        )
+
+        OrderItem.objects.filter(order_id__in=ids).delete()
+        Order.objects.filter(id__in=ids).delete()
+    return len(orders)
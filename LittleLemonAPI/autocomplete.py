@@ -0,0 +1,152 @@
+"""
+In-process prefix index of menu item and category titles for autocomplete.
+
+Every word of a title starts an entry, so "sal" finds "Greek Salad". Entries
+are kept in a sorted list searched with bisect, which a write replaces with an
+updated copy, so lookups never lock.
+
+Saves and deletes in this process update the index once they commit (the
+receivers are connected in apps.py), and bump a version in the cache. Saves
+that leave the title unchanged are skipped. Other processes rebuild their
+index from the database when they see the version change, checking it at
+most every AUTOCOMPLETE_VERSION_CHECK seconds; this requires a cache shared
+between processes. Bulk `update()` calls are not seen, so they must not
+change titles.
+"""
+
+import bisect
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Category, MenuItem
+
+VERSION_KEY = "autocomplete:version"
+WORD_START = re.compile(r"\b\w")
+
+KINDS = {MenuItem: "menuitem", Category: "category"}
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def entries(kind: str, id: int, title: str) -> list[tuple]:
+    key = normalize(title)
+    return sorted(
+        {(key[match.start() :], kind, id, title) for match in WORD_START.finditer(key)}
+    )
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: list[tuple] | None = None
+        # The title indexed for each (kind, id)
+        self.titles: dict[tuple, str] = {}
+        self.version = None
+        self.checked = 0.0
+
+    def load(self) -> list[tuple]:
+        """Rebuild the index from the database, unless another thread just did"""
+        with self.lock:
+            # Versions start at random so that an evicted version isn't reused
+            version = cache.get_or_set(VERSION_KEY, random.randrange(2**32), None)
+            if self.entries is not None and version == self.version:
+                return self.entries
+            self.titles = {
+                (kind, id): title
+                for model, kind in KINDS.items()
+                for id, title in model.objects.values_list("id", "title")
+            }
+            self.entries = sorted(
+                row
+                for (kind, id), title in self.titles.items()
+                for row in entries(kind, id, title)
+            )
+            self.version = version
+            self.checked = time.monotonic()
+            return self.entries
+
+    def ensure_loaded(self) -> list[tuple]:
+        snapshot = self.entries
+        if snapshot is None:
+            return self.load()
+        # Keystrokes don't each wait on the cache to learn of other processes'
+        # writes
+        interval = getattr(settings, "AUTOCOMPLETE_VERSION_CHECK", 1)
+        if time.monotonic() - self.checked >= interval:
+            self.checked = time.monotonic()
+            if cache.get(VERSION_KEY) != self.version:
+                snapshot = self.load()
+        return snapshot
+
+    def search(self, prefix: str, limit: int = 10) -> list[dict]:
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        found = {}
+        snapshot = self.ensure_loaded()
+        position = bisect.bisect_left(snapshot, (prefix,))
+        while position < len(snapshot) and len(found) < limit:
+            key, kind, id, title = snapshot[position]
+            if not key.startswith(prefix):
+                break
+            found.setdefault((kind, id), {"type": kind, "id": id, "title": title})
+            position += 1
+        return list(found.values())
+
+    def update(self, kind: str, id: int, title: str | None):
+        """Replace the entries of one object, or remove them if `title` is None"""
+        with self.lock:
+            if self.entries is not None:
+                old = self.titles.get((kind, id))
+                if old == title:
+                    return
+                updated = self.entries.copy()
+                if old is not None:
+                    for entry in entries(kind, id, old):
+                        del updated[bisect.bisect_left(updated, entry)]
+                    del self.titles[kind, id]
+                if title is not None:
+                    for entry in entries(kind, id, title):
+                        bisect.insort(updated, entry)
+                    self.titles[kind, id] = title
+                self.entries = updated
+
+            try:
+                version = cache.incr(VERSION_KEY)
+            except ValueError:
+                version = None
+            # Rebuild if the version was evicted or other processes changed
+            # the menu since this index was last in sync
+            if None in (version, self.version) or version != self.version + 1:
+                self.entries = None
+            self.version = version
+
+
+index = PrefixIndex()
+
+
+def prime():
+    """Load the index, run by `startup.warm_up` (see STARTUP_WARMUPS)"""
+    index.ensure_loaded()
+
+
+def index_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and "title" not in update_fields:
+        return
+    transaction.on_commit(
+        lambda: index.update(KINDS[sender], instance.id, instance.title)
+    )
+
+
+def unindex_deleted(sender, instance, **kwargs):
+    id = instance.id
+    transaction.on_commit(lambda: index.update(KINDS[sender], id, None))
@@ -0,0 +1,101 @@
+"""
+Cart storage backends.
+
+CartView and checkout go through the store named by the CART_STORAGE setting.
+Both stores hand out `Cart` instances so the serializers and checkout don't
+depend on where the cart lives, but only DatabaseCartStore's are saved rows.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError
+from django.utils.module_loading import import_string
+
+from .models import Cart, MenuItem
+
+
+class DatabaseCartStore:
+    """Keeps carts in the Cart table"""
+
+    def __init__(self, user):
+        self.user = user
+
+    def items(self):
+        return (
+            Cart.objects.select_related("user", "menuitem__category")
+            .filter(user=self.user)
+            .order_by("id")
+        )
+
+    def add(self, menuitem_id: int, quantity: int, unit_price) -> Cart:
+        return Cart.objects.create(
+            user=self.user,
+            menuitem_id=menuitem_id,
+            quantity=quantity,
+            unit_price=unit_price,
+        )
+
+    def clear(self):
+        Cart.objects.filter(user=self.user).delete()
+
+
+class CacheCartStore:
+    """
+    Keeps carts in the CART_CACHE cache for CART_TTL seconds after their last
+    change, so cart writes never touch the database.
+
+    A cart is a single cache entry, so concurrent writes to the same user's
+    cart are last-writer-wins.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.cache = caches[getattr(settings, "CART_CACHE", "default")]
+        self.key = f"cart:{user.pk}"
+        self.ttl = getattr(settings, "CART_TTL", 60 * 60 * 24)
+
+    def lines(self) -> list[dict]:
+        return self.cache.get(self.key, [])
+
+    def items(self) -> list[Cart]:
+        lines = self.lines()
+        menuitems = MenuItem.objects.select_related("category").in_bulk(
+            [line["menuitem_id"] for line in lines]
+        )
+        # Lines whose menu item has since been deleted are dropped
+        return [
+            self.build(menuitems[line["menuitem_id"]], **line)
+            for line in lines
+            if line["menuitem_id"] in menuitems
+        ]
+
+    def build(self, menuitem, menuitem_id, quantity, unit_price) -> Cart:
+        item = Cart(
+            user=self.user,
+            menuitem=menuitem,
+            quantity=quantity,
+            unit_price=unit_price,
+        )
+        item.price = item.get_price()
+        return item
+
+    def add(self, menuitem_id: int, quantity: int, unit_price) -> Cart:
+        lines = self.lines()
+        # Match the Cart table's ("menuitem", "user") unique constraint
+        if any(line["menuitem_id"] == menuitem_id for line in lines):
+            raise IntegrityError("menu item is already in the cart")
+
+        menuitem = MenuItem.objects.select_related("category").get(id=menuitem_id)
+        line = dict(menuitem_id=menuitem_id, quantity=quantity, unit_price=unit_price)
+        self.cache.set(self.key, [*lines, line], self.ttl)
+        return self.build(menuitem, **line)
+
+    def clear(self):
+        self.cache.delete(self.key)
+
+
+def get_cart_store(user):
+    store_class = import_string(
+        getattr(settings, "CART_STORAGE", "LittleLemonAPI.carts.DatabaseCartStore")
+    )
+    return store_class(user)
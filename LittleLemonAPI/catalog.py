@@ -0,0 +1,86 @@
+"""
+Cache of the serialized parts of the menu that are the same for every user.
+
+Entries are stored under the current catalog version for CATALOG_CACHE_TTL
+seconds. Saving or deleting a menu item or category bumps the version once the
+change commits (the receivers are connected in apps.py), so the old entries
+stop being used. Other processes only see the new version through a cache
+shared between processes; with the default per-process cache they serve their
+own entries for up to CATALOG_CACHE_TTL seconds. Bulk `update()` calls are not
+seen and must call `invalidate` themselves, as `MenuItemQuerySet.adjust_price`
+does.
+"""
+
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .coalesce import coalesce
+from .models import Category, MenuItem
+from .serializers import CategorySerializer, MenuItemSerializer
+
+VERSION_KEY = "catalog:version"
+
+
+def version() -> int:
+    # Versions start at random so that an evicted version isn't reused
+    return cache.get_or_set(VERSION_KEY, random.randrange(2**32), None)
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, random.randrange(2**32), None)
+
+
+def cached(name: str, build):
+    key = f"catalog:{version()}:{name}"
+    data = cache.get(key)
+    if data is None:
+
+        def build_and_store():
+            data = build()
+            cache.set(key, data, getattr(settings, "CATALOG_CACHE_TTL", 300))
+            return data
+
+        data = coalesce(key, build_and_store)
+    return data
+
+
+def categories() -> list[dict]:
+    queryset = Category.objects.order_by("id")
+    return cached(
+        "categories", lambda: list(CategorySerializer(queryset, many=True).data)
+    )
+
+
+def featured_items() -> list[dict]:
+    queryset = MenuItem.objects.select_related("category").filter(featured=True)
+    items = cached(
+        "featured",
+        lambda: list(MenuItemSerializer(queryset.order_by("id"), many=True).data),
+    )
+
+    # Stock changes with every checkout, so it is read fresh, when there is any
+    available = {}
+    limited = [item["id"] for item in items if item["daily_limit"] is not None]
+    if limited:
+        available = dict(
+            MenuItem.objects.filter(id__in=limited)
+            .with_availability()
+            .values_list("id", "available")
+        )
+    return [{**item, "available": available.get(item["id"])} for item in items]
+
+
+def prime():
+    """Fill the cache, run by `startup.warm_up` (see STARTUP_WARMUPS)"""
+    categories()
+    featured_items()
+
+
+def invalidate_on_write(sender, **kwargs):
+    transaction.on_commit(invalidate)
@@ -0,0 +1,135 @@
+"""
+Single-flight coalescing of identical read requests.
+
+Concurrent calls with the same key wait for the first one (the leader) and
+share its result instead of repeating the work. Nothing is kept once the
+leader finishes, so this is not a cache: a request that arrives afterwards
+runs again.
+
+With COALESCE_ACROSS_PROCESSES enabled, the leaders of different processes
+also coordinate through a lock added to the cache, never the database, so
+reads don't contend for SQLite's write lock. The process holding the lock
+publishes its result in the cache for COALESCE_RESULT_TTL seconds and the
+others wait for it there, which requires a cache shared between processes.
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import counter_family, registry
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: dict[str, Call] = {}
+        self.stats = {"executed": 0, "coalesced": 0, "shared": 0}
+
+    def do(self, key: str, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+                self.stats["executed"] += 1
+            call.done.set()
+        return call.result
+
+
+flight = SingleFlight()
+
+
+def collect_metrics() -> dict:
+    with flight.lock:
+        samples = [[[outcome], count] for outcome, count in flight.stats.items()]
+    return {
+        "littlelemon_coalesce_total": counter_family(
+            "Coalesced calls that ran, waited for another in this process, or "
+            "took the result of another process",
+            ["outcome"],
+            samples,
+        )
+    }
+
+
+registry.collectors.append(collect_metrics)
+
+
+def coalesce(key: str, func):
+    """Run `func`, or wait for a call with the same key that is in flight"""
+    if getattr(settings, "COALESCE_ACROSS_PROCESSES", False):
+        return flight.do(key, lambda: across_processes(key, func))
+    return flight.do(key, func)
+
+
+def across_processes(key: str, func, timeout: float = 5.0, poll: float = 0.02):
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    result_key = f"coalesce:{digest}"
+    deadline = time.monotonic() + timeout
+
+    while not (token := acquire(digest, timeout)):
+        result = cache.get(result_key)
+        if result is not None:
+            with flight.lock:
+                flight.stats["shared"] += 1
+            return result
+        # Give up waiting on a leader that is too slow or has died
+        if time.monotonic() > deadline:
+            return func()
+        time.sleep(poll)
+
+    try:
+        result = func()
+        cache.set(result_key, result, getattr(settings, "COALESCE_RESULT_TTL", 1))
+        return result
+    finally:
+        release(digest, token)
+
+
+def acquire(digest: str, timeout: float) -> str | None:
+    """
+    Take the lock of `digest`, returning its token, or None if another
+    process holds it. Locks of processes that died expire after `timeout`.
+    """
+    token = uuid.uuid4().hex
+    if cache.add(f"coalesce:lock:{digest}", token, timeout):
+        return token
+    return None
+
+
+def release(digest: str, token: str):
+    # Leave a lock that expired and was taken by another process alone. The
+    # cache can't compare and delete at once, so the taking-over between the
+    # two may still be lost, which only costs a duplicate execution.
+    lock_key = f"coalesce:lock:{digest}"
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
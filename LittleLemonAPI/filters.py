@@ -1,14 +1,77 @@
+from django.db.models import Case, CharField, Count, Q, Value, When
 from django_filters import rest_framework
 
 from . import models
 
+# (label, lowest price, highest price excluded) of the price bands offered as
+# a filter and counted by `facet_counts`
+PRICE_BANDS = [
+    ("under-5", None, 5),
+    ("5-10", 5, 10),
+    ("10-and-over", 10, None),
+]
+
+
+def price_band_q(low, high) -> Q:
+    q = Q()
+    if low is not None:
+        q &= Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
 
 class MenuItemFilter(rest_framework.FilterSet):
     category = rest_framework.CharFilter(
         field_name="category__title",
         lookup_expr="icontains",
     )
+    price_band = rest_framework.ChoiceFilter(
+        choices=[(label, label) for label, _, _ in PRICE_BANDS],
+        method="filter_price_band",
+    )
 
     class Meta:
         model = models.MenuItem
-        fields = ["category", "title", "featured"]
+        fields = ["category", "title", "featured", "price_band"]
+
+    def filter_price_band(self, queryset, name, value):
+        bands = {label: price_band_q(low, high) for label, low, high in PRICE_BANDS}
+        return queryset.filter(bands[value])
+
+
+def facet_counts(queryset) -> dict:
+    """
+    Count the menu items of `queryset` per category, featured flag and price
+    band, with one grouped query.
+    """
+    rows = (
+        queryset.order_by()
+        .annotate(
+            price_band=Case(
+                *[
+                    When(price_band_q(low, high), then=Value(label))
+                    for label, low, high in PRICE_BANDS
+                ],
+                output_field=CharField(),
+            )
+        )
+        .values("category__title", "featured", "price_band")
+        .annotate(count=Count("id"))
+    )
+
+    facets = {
+        "count": 0,
+        "category": {},
+        "featured": {"true": 0, "false": 0},
+        "price_band": {label: 0 for label, _, _ in PRICE_BANDS},
+    }
+    for row in rows:
+        facets["count"] += row["count"]
+        category = facets["category"]
+        category[row["category__title"]] = (
+            category.get(row["category__title"], 0) + row["count"]
+        )
+        facets["featured"]["true" if row["featured"] else "false"] += row["count"]
+        facets["price_band"][row["price_band"]] += row["count"]
+    return facets
@@ -0,0 +1,202 @@
+"""
+Idempotency keys for write requests.
+
+A client retrying a write sends the same `Idempotency-Key` header with each
+attempt. The first attempt claims the key in the IdempotencyKey table, and its
+response is stored in the same transaction as the view's writes (right after
+them with SQLITE_WRITER_LANE, which commits only the view's writes), so a retry
+gets the stored response back (with `Idempotent-Replayed: true`) without the
+view running again. Retries arriving while the first attempt is still running
+wait up to IDEMPOTENCY_WAIT seconds for its response, then get a 409.
+
+Keys are scoped to the user and the request's method and path, and reusing
+one with a different body is rejected with a 422. Responses are kept for
+IDEMPOTENCY_TTL seconds; the `run_jobs` worker purges expired ones. Responses
+to failed attempts (5xx, or views that raise) are not kept, so those can be
+retried. The claim of an attempt whose process died expires after
+IDEMPOTENCY_LEASE seconds.
+"""
+
+import datetime as dt
+import functools
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .metrics import registry
+from .models import IdempotencyKey
+from .writes import lane_enabled, run_with_retries, write
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+outcomes = registry.counter(
+    "littlelemon_idempotency_total",
+    "Requests sent with an Idempotency-Key, by whether they ran, were replayed "
+    "from a stored response or were rejected",
+    ["outcome"],
+)
+
+
+def digest(*parts) -> str:
+    return hashlib.sha1("\n".join(map(str, parts)).encode()).hexdigest()
+
+
+def fingerprint(request) -> str:
+    data = request.data
+    if hasattr(data, "lists"):
+        # Keep every value of repeated form fields
+        data = dict(data.lists())
+    return digest(json.dumps(data, sort_keys=True, default=str))
+
+
+def find(key: str) -> IdempotencyKey | None:
+    """The live claim of `key`, if any"""
+    return IdempotencyKey.objects.filter(key=key, expires__gte=now()).first()
+
+
+def claim(key: str, body: str) -> IdempotencyKey | None:
+    """Claim `key` for this request, or return the existing claim"""
+    lease = now() + dt.timedelta(seconds=getattr(settings, "IDEMPOTENCY_LEASE", 30))
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(key=key, fingerprint=body, expires=lease)
+        return None
+    except IntegrityError:
+        pass
+
+    # Take over claims whose response expired or whose request died
+    if IdempotencyKey.objects.filter(key=key, expires__lt=now()).update(
+        fingerprint=body, status_code=None, response=None, expires=lease
+    ):
+        return None
+    return IdempotencyKey.objects.filter(key=key).first()
+
+
+def wait(key: str) -> IdempotencyKey | None:
+    """
+    Wait for the request holding `key` to finish. Returns its claim, still in
+    progress if it didn't finish in time, or None if it was released.
+    """
+    deadline = time.monotonic() + getattr(settings, "IDEMPOTENCY_WAIT", 10)
+    poll = 0.01
+    while True:
+        time.sleep(poll)
+        poll = min(poll * 2, 0.25)
+        stored = IdempotencyKey.objects.filter(key=key).first()
+        if stored is None or stored.status_code is not None:
+            return stored
+        if time.monotonic() > deadline:
+            return stored
+
+
+def encode(response) -> object:
+    """The response's data as JSON, or raise TypeError"""
+    return json.loads(json.dumps(response.data, cls=JSONEncoder))
+
+
+def store(key: str, response):
+    """Keep `response` for replays, or release the key if it can't be replayed"""
+    stored = IdempotencyKey.objects.filter(key=key)
+    if response.status_code >= 500:
+        stored.delete()
+        return
+    try:
+        data = encode(response)
+    except TypeError:
+        stored.delete()
+        return
+    ttl = dt.timedelta(seconds=getattr(settings, "IDEMPOTENCY_TTL", 60 * 60 * 24))
+    stored.update(status_code=response.status_code, response=data, expires=now() + ttl)
+
+
+def replay(stored: IdempotencyKey) -> Response:
+    outcomes.inc("replayed")
+    return Response(
+        stored.response,
+        status=stored.status_code,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def conflict(message: str, code: int) -> Response:
+    outcomes.inc("rejected")
+    headers = {"Retry-After": "1"} if code == status.HTTP_409_CONFLICT else None
+    return Response({"message": message}, status=code, headers=headers)
+
+
+def idempotent(view):
+    """
+    Decorate a view, or view method, that writes, so that requests repeated
+    with the same Idempotency-Key run it once. Apply it outside
+    `retry_on_lock`, whose transaction it reuses.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Function views get the request first, view methods second
+        request = args[0] if isinstance(args[0], Request) else args[1]
+        header = request.headers.get(HEADER)
+        if not header:
+            return view(*args, **kwargs)
+        if len(header) > MAX_KEY_LENGTH:
+            return conflict(
+                f"{HEADER} must be at most {MAX_KEY_LENGTH} characters",
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        key = digest(request.user.id, request.method, request.get_full_path(), header)
+        body = fingerprint(request)
+        # Replays only read, so they don't wait for the database's write lock
+        while (stored := find(key) or run_with_retries(lambda: claim(key, body))):
+            if stored.fingerprint != body:
+                return conflict(
+                    f"{HEADER} was already used for a different request",
+                    status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if stored.status_code is None:
+                # In progress: wait for its response, or claim the key again
+                # if it gets released
+                stored = wait(key)
+                if stored is None:
+                    continue
+                if stored.status_code is None:
+                    return conflict(
+                        f"A request with this {HEADER} is still in progress",
+                        status.HTTP_409_CONFLICT,
+                    )
+            return replay(stored)
+
+        outcomes.inc("executed")
+
+        def run():
+            response = view(*args, **kwargs)
+            store(key, response)
+            return response
+
+        try:
+            if lane_enabled():
+                # The lane takes only the view's writes, not the view
+                response = view(*args, **kwargs)
+                write(lambda: store(key, response))
+                return response
+            return write(run)
+        except Exception:
+            write(lambda: IdempotencyKey.objects.filter(key=key).delete())
+            raise
+
+    return wrapper
+
+
+def purge() -> int:
+    """Delete the expired keys"""
+    deleted, _ = IdempotencyKey.objects.filter(expires__lt=now()).delete()
+    return deleted
@@ -0,0 +1,134 @@
+"""
+Daily stock of menu items with a `daily_limit`.
+
+An item's stock for the day is split across INVENTORY_SHARDS StockShard rows,
+created when it is first ordered that day. Checkout takes from a random shard
+with a conditional decrement (`remaining >= quantity`), so concurrent
+checkouts update different rows and none can take more than is left. When no
+single shard holds enough, the shards are locked and taken from in turn.
+
+`consolidate`, run by the `run_jobs` worker when idle, spreads what is left
+evenly across the shards again, so checkouts keep hitting the fast path, and
+deletes the shards of past days. A changed limit applies from the next day.
+"""
+
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import localdate
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import MenuItem, StockShard
+
+
+class SoldOut(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Not enough left today"
+    default_code = "sold_out"
+
+    def __init__(self, menuitem: MenuItem, available: int):
+        super().__init__(f"Only {available} {menuitem.title} left today")
+
+
+def split(total: int, shards: int) -> list[int]:
+    """Split `total` into `shards` parts differing by at most one"""
+    return [total // shards + (i < total % shards) for i in range(shards)]
+
+
+def create_shards(menuitem: MenuItem, day):
+    shards = getattr(settings, "INVENTORY_SHARDS", 8)
+    # Concurrent checkouts may both get here; the first one's shards are kept
+    StockShard.objects.bulk_create(
+        [
+            StockShard(menuitem=menuitem, date=day, shard=shard, remaining=remaining)
+            for shard, remaining in enumerate(split(menuitem.daily_limit, shards))
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def take(menuitem: MenuItem, quantity: int, day=None):
+    """Take `quantity` of a limited menu item from the day's stock"""
+    day = day or localdate()
+    shards = StockShard.objects.filter(menuitem=menuitem, date=day)
+
+    numbers = list(range(getattr(settings, "INVENTORY_SHARDS", 8)))
+    random.shuffle(numbers)
+    for number in numbers:
+        if shards.filter(shard=number, remaining__gte=quantity).update(
+            remaining=F("remaining") - quantity
+        ):
+            return
+        # The day's first checkout creates the shards below, rather than try
+        # each of them first
+        if number == numbers[0] and not shards.exists():
+            break
+
+    # No shard holds enough, or they don't exist yet
+    with transaction.atomic():
+        locked = list(shards.select_for_update().order_by("shard"))
+        if not locked:
+            create_shards(menuitem, day)
+            locked = list(shards.select_for_update().order_by("shard"))
+
+        available = sum(shard.remaining for shard in locked)
+        if available < quantity:
+            raise SoldOut(menuitem, available)
+        needed = quantity
+        for shard in locked:
+            taken = min(shard.remaining, needed)
+            if taken:
+                shards.filter(id=shard.id).update(remaining=F("remaining") - taken)
+                needed -= taken
+            if not needed:
+                break
+
+
+def take_all(lines: list[tuple[MenuItem, int]]):
+    """Take the limited items of (menu item, quantity) lines, all or none"""
+    with transaction.atomic():
+        for menuitem, quantity in lines:
+            if menuitem.daily_limit is not None:
+                take(menuitem, quantity)
+
+
+def check(menuitem_id: int, quantity: int):
+    """Raise SoldOut if less than `quantity` of a menu item is left today"""
+    menuitem = MenuItem.objects.with_availability().only("title").get(id=menuitem_id)
+    if menuitem.available is not None and menuitem.available < quantity:
+        raise SoldOut(menuitem, menuitem.available)
+
+
+def consolidate(day=None) -> int:
+    """
+    Spread the stock left of each limited item evenly across its shards, and
+    delete the shards of earlier days. Returns the number of items rebalanced.
+    """
+    day = day or localdate()
+    StockShard.objects.filter(date__lt=day).delete()
+
+    limited = (
+        StockShard.objects.filter(date=day)
+        .order_by("menuitem")
+        .values_list("menuitem", flat=True)
+        .distinct()
+    )
+    rebalanced = 0
+    for menuitem_id in list(limited):
+        with transaction.atomic():
+            shards = list(
+                StockShard.objects.filter(menuitem_id=menuitem_id, date=day)
+                .select_for_update()
+                .order_by("shard")
+            )
+            counts = split(sum(s.remaining for s in shards), len(shards))
+            if sorted(counts) == sorted(s.remaining for s in shards):
+                continue
+            for shard, remaining in zip(shards, counts):
+                shard.remaining = remaining
+            StockShard.objects.bulk_update(shards, ["remaining"])
+            rebalanced += 1
+    return rebalanced
@@ -0,0 +1,131 @@
+"""
+Database-backed background jobs.
+
+`enqueue` adds a row to the Job table, so a job enqueued inside a transaction
+only reaches the workers if that transaction commits. The `run_jobs` command
+claims due jobs in batches and runs them. A job's task is the dotted path of a
+function, which is called with the job's payload as keyword arguments.
+
+Tasks run outside any transaction, since SQLite has a single writer and a
+task may wait on the network, so they make their writes in short
+transactions of their own (see `writes.write`). The job's outcome is recorded
+in a separate write after the task returns.
+
+A claimed job is hidden from other workers for JOB_LEASE seconds. The job of
+a worker that dies mid-job is claimed again once the lease runs out, so tasks
+must be idempotent. Failing jobs are retried with exponential backoff until
+they have been attempted JOB_MAX_ATTEMPTS times, then marked failed. Failed
+jobs can be run again with `retry`; like finished jobs, they are purged after
+a few days, which frees their key.
+"""
+
+import datetime as dt
+import random
+import traceback
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from .models import Job
+from .writes import write
+
+
+def task_name(task) -> str:
+    if isinstance(task, str):
+        return task
+    return f"{task.__module__}.{task.__qualname__}"
+
+
+def enqueue(task, key: str | None = None, delay: float = 0, **payload) -> Job | None:
+    """
+    Add a job calling `task` (a function or its dotted path) with `payload`
+    after `delay` seconds. Returns None if a job with the same `key` exists.
+    """
+    job = Job(
+        task=task_name(task),
+        payload=payload,
+        key=key,
+        run_at=now() + dt.timedelta(seconds=delay),
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        if key is None:
+            raise
+        return None
+    return job
+
+
+def claim(batch_size: int) -> list[Job]:
+    """Claim up to `batch_size` due jobs for this worker"""
+    token = uuid.uuid4().hex
+    current = now()
+    lease = dt.timedelta(seconds=getattr(settings, "JOB_LEASE", 60))
+
+    due = (
+        Job.objects.filter(status=Job.PENDING, run_at__lte=current)
+        .order_by("run_at")
+        .values("id")[:batch_size]
+    )
+    # Where the database has row locks, jobs being claimed by other workers are
+    # skipped rather than waited for. SQLite has a single writer, so the UPDATE
+    # alone claims the batch atomically.
+    if connection.features.has_select_for_update_skip_locked:
+        due = due.select_for_update(skip_locked=True)
+
+    with transaction.atomic():
+        Job.objects.filter(id__in=due).update(
+            claimed_by=token,
+            run_at=current + lease,
+            attempts=F("attempts") + 1,
+        )
+    return list(
+        Job.objects.filter(claimed_by=token, status=Job.PENDING).order_by("run_at")
+    )
+
+
+def backoff(attempts: int) -> dt.timedelta:
+    """Exponential delay before the next attempt, with jitter"""
+    base = getattr(settings, "JOB_BACKOFF", 2)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, "JOB_MAX_BACKOFF", 3600))
+    return dt.timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+def run(job: Job) -> bool:
+    """Run a claimed job, returning whether it succeeded"""
+    claimed = Job.objects.filter(id=job.id, claimed_by=job.claimed_by)
+    try:
+        import_string(job.task)(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= getattr(settings, "JOB_MAX_ATTEMPTS", 5):
+            write(lambda: claimed.update(status=Job.FAILED, last_error=error))
+        else:
+            retry_at = now() + backoff(job.attempts)
+            write(
+                lambda: claimed.update(run_at=retry_at, claimed_by="", last_error=error)
+            )
+        return False
+    write(lambda: claimed.update(status=Job.DONE))
+    return True
+
+
+def retry(jobs) -> int:
+    """Run the failed jobs of the `jobs` queryset again, as if new"""
+    return jobs.filter(status=Job.FAILED).update(
+        status=Job.PENDING, attempts=0, run_at=now(), claimed_by=""
+    )
+
+
+def purge(days: int) -> int:
+    """Delete jobs that succeeded or failed more than `days` days ago"""
+    cutoff = now() - dt.timedelta(days=days)
+    deleted, _ = Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED], run_at__lt=cutoff
+    ).delete()
+    return deleted
@@ -0,0 +1,30 @@
+import decimal
+
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.models import MenuItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Multiply menu prices by --factor (e.g. 1.05 for a 5 percent increase) and "
+        "reprice the open carts holding those items. Carts kept in the cache by "
+        "CacheCartStore keep the price they were added at."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--factor", type=decimal.Decimal, required=True)
+        parser.add_argument("--category", help="only adjust this category's items")
+        parser.add_argument(
+            "--keep-carts",
+            action="store_true",
+            help="leave the unit price of items already in carts unchanged",
+        )
+
+    def handle(self, *args, factor, category, keep_carts: bool, **options):
+        menuitems = MenuItem.objects.all()
+        if category:
+            menuitems = menuitems.filter(category__title=category)
+
+        count = menuitems.adjust_price(factor, reprice_carts=not keep_carts)
+        self.stdout.write(f"adjusted {count} menu items by a factor of {factor}")
@@ -0,0 +1,33 @@
+import datetime as dt
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from LittleLemonAPI.archive import archive_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Move delivered orders older than --days into the archive tables, in "
+        "batches of --batch-size orders per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=90)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="seconds to wait between batches to let other writers in",
+        )
+
+    def handle(self, *args, days: int, batch_size: int, pause: float, **options):
+        cutoff = now().date() - dt.timedelta(days=days)
+        total = 0
+        while moved := archive_batch(cutoff, batch_size):
+            total += moved
+            self.stdout.write(f"archived {total} orders")
+            time.sleep(pause)
+        self.stdout.write(f"done: archived {total} orders placed before {cutoff}")
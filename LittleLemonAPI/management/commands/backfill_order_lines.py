@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from LittleLemonAPI.models import ArchivedOrderItem, MenuItem, OrderItem
+
+
+def backfill_batch(model, after: int, batch_size: int) -> int | None:
+    """
+    Copy the menu item titles onto the lines of `model` with an id above
+    `after` that have none, up to `batch_size` ids at a time. Returns the
+    last id visited, or None when there are no more lines.
+    """
+    with transaction.atomic():
+        ids = list(
+            model.objects.filter(id__gt=after)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return None
+
+        menuitem = MenuItem.objects.filter(id=OuterRef("menuitem_id"))
+        model.objects.filter(id__in=ids, title="").update(
+            # Lines of deleted menu items have nothing left to copy
+            title=Coalesce(Subquery(menuitem.values("title")), Value("")),
+            category_title=Coalesce(
+                Subquery(menuitem.values("category__title")), Value("")
+            ),
+        )
+    return ids[-1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the title and category title of their menu item onto the order "
+        "lines (current and archived) placed before checkout recorded them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="seconds to wait between batches to let other writers in",
+        )
+
+    def handle(self, *args, batch_size: int, pause: float, **options):
+        for model in [OrderItem, ArchivedOrderItem]:
+            last = 0
+            while (last := backfill_batch(model, last, batch_size)) is not None:
+                self.stdout.write(f"{model.__name__}: up to id {last}")
+                time.sleep(pause)
+        self.stdout.write("done")
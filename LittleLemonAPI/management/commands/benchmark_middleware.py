@@ -0,0 +1,57 @@
+import time
+import types
+
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+
+
+@csrf_exempt
+def ping(request):
+    return HttpResponse(b"{}", content_type="application/json")
+
+
+# Served instead of the project's URLs so only the middleware is measured
+urls = types.ModuleType("benchmark_urls")
+urls.urlpatterns = [path("api/ping", ping)]
+
+
+def time_requests(make_request, repeat: int) -> float:
+    """Average wall-clock seconds per request through the middleware stack"""
+    handler = BaseHandler()
+    handler.load_middleware()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        request = make_request()
+        request.urlconf = urls
+        handler.get_response(request)
+    return (time.perf_counter() - start) / repeat
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the per-request cost of the middleware stack for a "
+        "token-authenticated /api/ request with and without the lean profile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=5000)
+
+    @override_settings(ALLOWED_HOSTS=["testserver"])
+    def handle(self, *args, repeat: int, **options):
+        factory = RequestFactory()
+
+        def token_request():
+            return factory.get("/api/ping", HTTP_AUTHORIZATION="Token abc")
+
+        lean = time_requests(token_request, repeat)
+        with override_settings(LEAN_MIDDLEWARE_PATHS=[]):
+            full = time_requests(token_request, repeat)
+
+        self.stdout.write(f"full stack: {full * 1e6:8.1f} us/request")
+        self.stdout.write(f"lean stack: {lean * 1e6:8.1f} us/request")
+        self.stdout.write(f"saved:      {(full - lean) * 1e6:8.1f} us/request")
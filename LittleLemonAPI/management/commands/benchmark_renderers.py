@@ -0,0 +1,75 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from LittleLemonAPI import middleware, renderers
+from LittleLemonAPI.models import MenuItem, Order
+from LittleLemonAPI.serializers import MenuItemSerializer, OrderSerializer
+
+RENDERERS = {
+    "json": JSONRenderer,
+    "fast-json": renderers.FastJSONRenderer,
+}
+if renderers.msgpack is not None:
+    RENDERERS["msgpack"] = renderers.MessagePackRenderer
+
+
+def cpu_time(func, repeat: int) -> float:
+    """Average CPU seconds per call"""
+    start = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - start) / repeat
+
+
+class Command(BaseCommand):
+    help = (
+        "Report bytes and CPU time per response for the /api/menu-items and "
+        "/api/orders payloads under each renderer. Load the fixtures first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=200)
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="number of rows per payload (default: the whole table)",
+        )
+
+    def handle(self, *args, repeat: int, limit: int, **options):
+        payloads = {
+            "/api/menu-items": MenuItemSerializer(
+                MenuItem.objects.select_related("category").order_by("id")[:limit],
+                many=True,
+            ).data,
+            "/api/orders": OrderSerializer(
+                Order.objects.select_related("user", "delivery_crew").order_by("id")[
+                    :limit
+                ],
+                many=True,
+            ).data,
+        }
+
+        self.stdout.write(
+            f"{'endpoint':<16} {'renderer':<10} {'bytes':>8} {'gzip':>8} "
+            f"{'br':>8} {'render us':>10} {'gzip us':>10}"
+        )
+        for endpoint, data in payloads.items():
+            for name, renderer_class in RENDERERS.items():
+                renderer = renderer_class()
+                content = renderer.render(data)
+                render_time = cpu_time(lambda: renderer.render(data), repeat)
+                gzip_time = cpu_time(lambda: gzip.compress(content), repeat)
+                gzipped = len(gzip.compress(content))
+                brotlied = (
+                    len(middleware.brotli.compress(content))
+                    if middleware.brotli is not None
+                    else "-"
+                )
+                self.stdout.write(
+                    f"{endpoint:<16} {name:<10} {len(content):>8} {gzipped:>8} "
+                    f"{brotlied:>8} {render_time * 1e6:>10.1f} {gzip_time * 1e6:>10.1f}"
+                )
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI import idempotency, inventory
+from LittleLemonAPI.jobs import claim, purge, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs as they become due, in batches of --batch-size. "
+        "When idle, purge finished and failed jobs and expired idempotency keys and "
+        "rebalance the stock counters of limited menu items."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10)
+        parser.add_argument(
+            "--idle",
+            type=float,
+            default=1.0,
+            help="seconds to wait before polling again when no job is due",
+        )
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=7,
+            help="days to keep finished and failed jobs, whose keys block duplicates",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="exit once no job is due"
+        )
+
+    def handle(
+        self, *args, batch_size: int, idle: float, keep_days: int, once, **options
+    ):
+        succeeded = failed = 0
+        while True:
+            jobs = claim(batch_size)
+            if not jobs:
+                purge(keep_days)
+                idempotency.purge()
+                inventory.consolidate()
+                if once:
+                    break
+                time.sleep(idle)
+                continue
+
+            for job in jobs:
+                if run(job):
+                    succeeded += 1
+                else:
+                    failed += 1
+                    self.stderr.write(f"job {job.id} ({job.task}) failed")
+        self.stdout.write(f"done: {succeeded} jobs succeeded, {failed} failed")
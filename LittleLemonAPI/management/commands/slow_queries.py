@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI.queryplan import plan_problems
+from LittleLemonAPI.slowlog import aggregate, read_log
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the statements of the slow-query log that took the most time, "
+        "grouped by fingerprint, with the query plan of their slowest run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument(
+            "--sort", choices=["total", "max", "count"], default="total"
+        )
+        parser.add_argument("--file", help="defaults to SLOW_QUERY_LOG_FILE")
+
+    def handle(self, *args, limit: int, sort: str, file, **options):
+        path = file or settings.SLOW_QUERY_LOG_FILE
+        try:
+            entries = read_log(path)
+        except FileNotFoundError:
+            raise CommandError(f"no slow-query log at {path}")
+
+        groups = sorted(aggregate(entries), key=lambda group: -group[sort])
+        for group in groups[:limit]:
+            self.stdout.write(
+                f"{group['count']:>6} runs {group['total']:>10.1f}ms total "
+                f"{group['max']:>8.1f}ms max  {group['fingerprint']}"
+            )
+            self.stdout.write(f"  views: {', '.join(sorted(group['views']))}")
+            self.stdout.write(f"  {group['sql']}")
+            problems = plan_problems(group["plan"])
+            for detail in group["plan"]:
+                marker = "!" if detail in problems else " "
+                self.stdout.write(f"  {marker} {detail}")
+            self.stdout.write("")
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from LittleLemonAPI.writes import run_with_retries, writer_lane
+
+# A table of the main database rather than a TEMP one, which SQLite keeps per
+# connection and outside the main database's write lock
+SCRATCH_TABLE = "littlelemon_stress_scratch"
+
+
+def insert_row():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {SCRATCH_TABLE} (value) VALUES (%s)", [threading.get_ident()]
+        )
+
+
+def plain_write(func):
+    with transaction.atomic():
+        return func()
+
+
+def lane_write(func):
+    return writer_lane().submit(func).result()
+
+
+def hammer(write_func, threads: int, writes: int) -> tuple[int, int, float]:
+    """Make `threads` threads each do `writes` small writes at the same time"""
+    committed = []
+    failed = []
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        try:
+            for _ in range(writes):
+                try:
+                    write_func(insert_row)
+                    committed.append(1)
+                except Exception:
+                    failed.append(1)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return len(committed), len(failed), time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = (
+        "Write small rows to the database from --threads threads at once, "
+        "without retries, with retries and through the writer lane, and report "
+        "the committed writes per second of each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--writes", type=int, default=100)
+        parser.add_argument(
+            "--mode",
+            choices=["plain", "retry", "lane"],
+            action="append",
+            help="run only this mode; may be repeated",
+        )
+
+    def handle(self, *args, threads: int, writes: int, mode, **options):
+        write_funcs = {
+            "plain": plain_write,
+            "retry": run_with_retries,
+            "lane": lane_write,
+        }
+        with connection.cursor() as cursor:
+            # Left over if an earlier run was killed
+            cursor.execute(f"DROP TABLE IF EXISTS {SCRATCH_TABLE}")
+            cursor.execute(
+                f"CREATE TABLE {SCRATCH_TABLE} (id INTEGER PRIMARY KEY, value INTEGER)"
+            )
+        try:
+            for name in mode or write_funcs:
+                committed, failed, elapsed = hammer(write_funcs[name], threads, writes)
+                self.stdout.write(
+                    f"{name:>5}: {committed} committed, {failed} failed, "
+                    f"{committed / elapsed:8.0f} writes/s"
+                )
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {SCRATCH_TABLE}")
@@ -0,0 +1,301 @@
+"""
+In-process metrics, served in the Prometheus text format at /metrics.
+
+Counters and fixed-bucket histograms live in `registry`. With METRICS_DIR set
+to a directory shared by the worker processes, each process writes a snapshot
+of its metrics there at most every METRICS_FLUSH_INTERVAL seconds, and
+/metrics adds up the snapshots of all processes, which must run on the same
+host, since a snapshot is named after its process's PID. The snapshots of
+processes that have exited are folded into one, so counters never go
+backwards while the files don't pile up; clear the directory when the service
+is restarted. Gauges describe the present, so those of exited processes are
+dropped.
+
+Collectors are functions called for each snapshot that report state kept
+elsewhere, such as the admission gates and the coalescing stats.
+"""
+
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_BUCKETS = [1, 2, 5, 10, 20, 50, 100]
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: list[str]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values: dict[tuple, object] = {}
+
+    def samples(self) -> list:
+        with self.lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Histogram(Metric):
+    """
+    Keeps, per set of labels, the count of values in each bucket and above
+    the last one (not cumulative), followed by the sum of the values.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: list[str], buckets: list):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> list:
+        with self.lock:
+            return [[list(labels), list(v)] for labels, v in self.values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.collectors = []
+        self.flushed = 0.0
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: list[str]) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: list[str], buckets) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def snapshot(self) -> dict:
+        families = {
+            metric.name: {
+                "type": metric.type,
+                "help": metric.help,
+                "labels": metric.labels,
+                "buckets": getattr(metric, "buckets", None),
+                "samples": metric.samples(),
+            }
+            for metric in self.metrics.values()
+        }
+        for collect in self.collectors:
+            families.update(collect())
+        return families
+
+    def flush(self, force: bool = False):
+        """Write this process's snapshot to METRICS_DIR, if due"""
+        directory = getattr(settings, "METRICS_DIR", None)
+        interval = getattr(settings, "METRICS_FLUSH_INTERVAL", 5)
+        if not directory or (not force and time.monotonic() - self.flushed < interval):
+            return
+        self.flushed = time.monotonic()
+
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(f"{path}.tmp", path)
+
+
+registry = Registry()
+atexit.register(registry.flush, force=True)
+
+
+def gauge_family(help: str, labels: list[str], samples: list) -> dict:
+    return {"type": "gauge", "help": help, "labels": labels, "samples": samples}
+
+
+def counter_family(help: str, labels: list[str], samples: list) -> dict:
+    return {"type": "counter", "help": help, "labels": labels, "samples": samples}
+
+
+def merge(snapshots: list[dict]) -> dict:
+    """Add up the samples with the same labels across snapshots"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            totals = merged.setdefault(name, {**family, "samples": {}})["samples"]
+            for labels, value in family["samples"]:
+                key = tuple(labels)
+                if key not in totals:
+                    totals[key] = value
+                elif isinstance(value, list):
+                    totals[key] = [a + b for a, b in zip(totals[key], value)]
+                else:
+                    totals[key] = totals[key] + value
+    return merged
+
+
+EXITED = "exited.json"
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, as another user
+        return True
+    return True
+
+
+def read_snapshot(path: str) -> dict | None:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        # Being replaced, or written by a process that died
+        return None
+
+
+def fold_exited(directory: str, paths: list[str]) -> dict:
+    """
+    Add the counters and histograms of the snapshots at `paths`, left by
+    processes that exited, to the EXITED snapshot and delete them. Returns
+    the EXITED snapshot.
+    """
+    exited = os.path.join(directory, EXITED)
+    # Scrapes of several processes may fold at once
+    with open(os.path.join(directory, "fold.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshots = [read_snapshot(exited) or {}]
+        for path in paths:
+            snapshot = read_snapshot(path)
+            if snapshot is not None:
+                snapshots.append(
+                    {
+                        name: family
+                        for name, family in snapshot.items()
+                        if family["type"] != "gauge"
+                    }
+                )
+        folded = {
+            name: {
+                **family,
+                "samples": [[list(k), v] for k, v in family["samples"].items()],
+            }
+            for name, family in merge(snapshots).items()
+        }
+        with open(f"{exited}.tmp", "w") as file:
+            json.dump(folded, file)
+        os.replace(f"{exited}.tmp", exited)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return folded
+
+
+def collect() -> dict:
+    """The metrics of every process, this one's being current"""
+    snapshots = [registry.snapshot()]
+    directory = getattr(settings, "METRICS_DIR", None)
+    if directory:
+        own = f"{os.getpid()}.json"
+        exited = []
+        for name in os.listdir(directory):
+            pid = name.removesuffix(".json")
+            if name == own or not name.endswith(".json") or not pid.isdigit():
+                continue
+            path = os.path.join(directory, name)
+            if not is_alive(int(pid)):
+                exited.append(path)
+            elif (snapshot := read_snapshot(path)) is not None:
+                snapshots.append(snapshot)
+        if exited:
+            snapshots.append(fold_exited(directory, exited))
+        else:
+            snapshots.append(read_snapshot(os.path.join(directory, EXITED)) or {})
+    return merge(snapshots)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def format_labels(names: list[str], values, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(families: dict) -> str:
+    """Format metric families in the Prometheus text exposition format"""
+    lines = []
+    for name, family in sorted(families.items()):
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        labels = family["labels"]
+        for values, value in sorted(family["samples"].items()):
+            if family["type"] != "histogram":
+                lines.append(
+                    f"{name}{format_labels(labels, values)} {format_number(value)}"
+                )
+                continue
+
+            cumulative = 0
+            bounds = [*map(format_number, family["buckets"]), "+Inf"]
+            for bound, count in zip(bounds, value[:-1]):
+                cumulative += count
+                bucket_labels = format_labels(labels, values, f'le="{bound}"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(
+                f"{name}_sum{format_labels(labels, values)} {format_number(value[-1])}"
+            )
+            lines.append(f"{name}_count{format_labels(labels, values)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+requests = registry.counter(
+    "littlelemon_requests_total",
+    "Requests handled, by URL name, method and status code",
+    ["view", "method", "status"],
+)
+request_duration = registry.histogram(
+    "littlelemon_request_duration_seconds",
+    "Time to produce a response, by URL name",
+    ["view"],
+    DURATION_BUCKETS,
+)
+request_queries = registry.histogram(
+    "littlelemon_request_queries",
+    "SQL statements run per request, by URL name",
+    ["view"],
+    QUERY_BUCKETS,
+)
+throttled = registry.counter(
+    "littlelemon_throttled_total",
+    "Requests rejected by the rate throttles, by URL name",
+    ["view"],
+)
@@ -0,0 +1,225 @@
+import gzip
+import re
+import time
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import JsonResponse
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+from .admission import get_admission
+from .slowlog import SlowQueryRecorder
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Responses rendered by the API, which carry no CSRF token
+API_CONTENT_TYPES = ["application/json", "application/msgpack"]
+
+
+class MetricsMiddleware:
+    """Count requests, their duration and their SQL statements per URL name"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        # Unnamed routes are labelled with their view's dotted path
+        match = request.resolver_match
+        view = match.view_name if match else "none"
+        metrics.requests.inc(view, request.method, str(response.status_code))
+        metrics.request_duration.observe(duration, view)
+        metrics.request_queries.observe(queries, view)
+        if response.status_code == 429:
+            metrics.throttled.inc(view)
+        metrics.registry.flush()
+        return response
+
+
+def accepted_encodings(header: str) -> dict[str, float]:
+    """The q-value of each coding of an Accept-Encoding header"""
+    weights = {}
+    for item in header.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            weights[coding.lower()] = weight
+    return weights
+
+
+def choose_encoding(header: str, available: list[str]) -> str | None:
+    """The most preferred of the `available` codings the client accepts"""
+    weights = accepted_encodings(header)
+
+    def weight(coding: str) -> float:
+        return weights.get(coding, weights.get("*", 0.0))
+
+    # Ties go to the earlier coding of `available`
+    best = max(available, key=weight)
+    return best if weight(best) > 0 else None
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress API responses of at least COMPRESSION_MIN_SIZE bytes.
+
+    Brotli is used when the brotli package is installed and the client
+    prefers it, otherwise gzip. Small responses are sent as they are, since
+    compressing them costs more CPU than the bytes it saves. Other responses,
+    such as admin pages carrying a CSRF token, are left to GZipMiddleware,
+    whose random padding mitigates BREACH.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.min_size = getattr(settings, "COMPRESSION_MIN_SIZE", 1024)
+
+    def process_response(self, request, response):
+        if response.has_header("Content-Encoding"):
+            return response
+        accept_encoding = request.headers.get("Accept-Encoding", "")
+        content_type = response.get("Content-Type", "").partition(";")[0].strip()
+        if response.streaming or content_type not in API_CONTENT_TYPES:
+            if choose_encoding(accept_encoding, ["gzip"]) is None:
+                return response
+            return super().process_response(request, response)
+        if len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        available = ["br", "gzip"] if brotli is not None else ["gzip"]
+        encoding = choose_encoding(accept_encoding, available)
+        if encoding == "br":
+            content = brotli.compress(response.content)
+        elif encoding == "gzip":
+            content = gzip.compress(response.content, mtime=0)
+        else:
+            return response
+
+        # Keep the uncompressed response if compression didn't help
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response["Content-Length"] = str(len(content))
+        response["Content-Encoding"] = encoding
+        if response.has_header("ETag"):
+            response["ETag"] = re.sub(r'^(W/)?"', 'W/"', response["ETag"])
+        return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Limit the number of concurrent requests per ADMISSION_CLASSES class,
+    answering 503 with Retry-After when no slot frees up in time.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            gate = getattr(request, "admission_gate", None)
+            if gate is not None:
+                gate.release()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        gate = get_admission().gate(request.method, request.resolver_match.url_name)
+        if gate is None:
+            return None
+        if not gate.acquire():
+            response = JsonResponse(
+                {"message": "The server is busy, please retry later"}, status=503
+            )
+            response["Retry-After"] = str(gate.retry_after)
+            return response
+        request.admission_gate = gate
+        return None
+
+
+class SlowQueryMiddleware:
+    """Log the slow statements of each request, if SLOW_QUERY_LOG is enabled"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, "SLOW_QUERY_LOG", False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with connection.execute_wrapper(SlowQueryRecorder(request)):
+            return self.get_response(request)
+
+
+def uses_lean_middleware(request) -> bool:
+    """
+    Requests to LEAN_MIDDLEWARE_PATHS that authenticate with a token, or that
+    carry no session cookie at all, have no use for sessions, CSRF, messages or
+    frame options. The decision is made once per request.
+    """
+    if not hasattr(request, "lean_middleware"):
+        request.lean_middleware = request.path_info.startswith(
+            tuple(getattr(settings, "LEAN_MIDDLEWARE_PATHS", []))
+        ) and (
+            request.META.get("HTTP_AUTHORIZATION", "").startswith("Token ")
+            or settings.SESSION_COOKIE_NAME not in request.COOKIES
+        )
+    return request.lean_middleware
+
+
+def skipped_by_lean_requests(middleware_class):
+    """Wrap a middleware so it does nothing for lean requests"""
+
+    class Middleware(middleware_class):
+        def __call__(self, request):
+            if uses_lean_middleware(request):
+                return self.get_response(request)
+            return super().__call__(request)
+
+        def process_view(self, request, *args, **kwargs):
+            if uses_lean_middleware(request):
+                return None
+            return super().process_view(request, *args, **kwargs)
+
+    if not hasattr(middleware_class, "process_view"):
+        del Middleware.process_view
+
+    Middleware.__name__ = Middleware.__qualname__ = f"Lean{middleware_class.__name__}"
+    return Middleware
+
+
+LeanSessionMiddleware = skipped_by_lean_requests(SessionMiddleware)
+LeanCsrfViewMiddleware = skipped_by_lean_requests(CsrfViewMiddleware)
+LeanAuthenticationMiddleware = skipped_by_lean_requests(AuthenticationMiddleware)
+LeanMessageMiddleware = skipped_by_lean_requests(MessageMiddleware)
+LeanXFrameOptionsMiddleware = skipped_by_lean_requests(XFrameOptionsMiddleware)
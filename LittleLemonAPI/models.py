@@ -2,8 +2,10 @@ import decimal
 
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.utils.timezone import now
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Round
+from django.utils.timezone import localdate, now
 
 
 # NOTE: Use to join fixtures by title rather than pk
@@ -12,6 +14,56 @@ class CategoryManager(models.Manager):
         return self.get(title=title)
 
 
+class MenuItemQuerySet(models.QuerySet):
+    def adjust_price(self, factor: decimal.Decimal, reprice_carts: bool = True):
+        """
+        Multiply the price of these menu items by `factor`, optionally
+        repricing the open carts that hold them in a single statement too.
+        Carts kept by CacheCartStore keep the price they were added at.
+        """
+        # Imported here, as the catalog imports the models
+        from .catalog import invalidate
+
+        with transaction.atomic():
+            # Fixed before the update, which may change which items match
+            ids = list(self.values_list("id", flat=True))
+            count = self.filter(id__in=ids).update(price=Round(F("price") * factor, 2))
+            if reprice_carts:
+                Cart.objects.filter(menuitem__in=ids).reprice()
+            # Bulk updates send no signals
+            transaction.on_commit(invalidate)
+        return count
+
+    def with_availability(self, day=None):
+        """
+        Annotate how many of each menu item can still be ordered on `day`
+        (today by default) as `available`, None for items without a limit.
+        """
+        remaining = (
+            StockShard.objects.filter(menuitem=OuterRef("id"), date=day or localdate())
+            .values("menuitem")
+            .annotate(total=Sum("remaining"))
+            .values("total")
+        )
+        # Nothing has been taken from an item's stock before its shards exist
+        return self.annotate(available=Coalesce(Subquery(remaining), F("daily_limit")))
+
+
+class LineQuerySet(models.QuerySet):
+    """Bulk operations on cart and order lines, whose price the database keeps"""
+
+    def set_quantity(self, quantity: int) -> int:
+        return self.update(quantity=quantity)
+
+    def reprice(self) -> int:
+        """Set the unit price of these lines to their menu item's current price"""
+        return self.update(
+            unit_price=Subquery(
+                MenuItem.objects.filter(id=OuterRef("menuitem_id")).values("price")
+            )
+        )
+
+
 class Category(models.Model):
     slug = models.SlugField()
     title = models.CharField(max_length=255, db_index=True, unique=True)
@@ -31,6 +83,9 @@ class MenuItem(models.Model):
     )
     featured = models.BooleanField(db_index=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    # How many can be ordered per day, without limit if None (see inventory.py)
+    daily_limit = models.PositiveIntegerField(null=True, blank=True, default=None)
+    objects = MenuItemQuerySet.as_manager()
 
     class Meta:
         unique_together = ("title", "category")
@@ -40,7 +95,8 @@ class MenuItem(models.Model):
 
 
 class Cart(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # NOTE: indexed through Meta.indexes as (user, id)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.SmallIntegerField(validators=[MinValueValidator(1)])
     unit_price = models.DecimalField(
@@ -48,34 +104,38 @@ class Cart(models.Model):
         decimal_places=2,
         validators=[MinValueValidator(decimal.Decimal("0.00"))],
     )
-    price = models.DecimalField(
-        max_digits=6,
-        decimal_places=2,
-        validators=[MinValueValidator(decimal.Decimal("0.00"))],
+    # Maintained by the database, so queryset updates keep it correct
+    price = models.GeneratedField(
+        expression=F("unit_price") * F("quantity"),
+        output_field=models.DecimalField(max_digits=6, decimal_places=2),
+        db_persist=True,
     )
+    objects = LineQuerySet.as_manager()
 
     class Meta:
         unique_together = ("menuitem", "user")
+        indexes = [
+            # CartView lists a user's cart ordered by id
+            models.Index(fields=["user", "id"], name="cart_user_id_idx"),
+        ]
 
     def get_price(self):
         return self.unit_price * self.quantity
 
-    def save(self, *args, **kwargs):
-        self.price = self.get_price()
-        super().save(*args, **kwargs)
-
     def __str__(self):
         return self.user.username
 
 
 class Order(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # NOTE: indexed through Meta.indexes as (user, id) and (delivery_crew, id)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     delivery_crew = models.ForeignKey(
         User,
         on_delete=models.SET_NULL,
         related_name="delivery_crew",
         null=True,
         default=None,
+        db_index=False,
     )
     status = models.BooleanField(db_index=True, default=0)
     total = models.DecimalField(
@@ -84,25 +144,42 @@ class Order(models.Model):
         validators=[MinValueValidator(decimal.Decimal("0.00"))],
     )
     date = models.DateField(db_index=True, default=now)
+    # Set by tasks.send_receipt, so a job run twice sends one receipt
+    receipt_sent = models.DateTimeField(null=True, default=None)
+
+    class Meta:
+        indexes = [
+            # OrderView.list pages through a customer's or a crew member's
+            # orders ordered by id
+            models.Index(fields=["user", "id"], name="order_user_id_idx"),
+            models.Index(fields=["delivery_crew", "id"], name="order_crew_id_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.user} | {self.date} | {self.total}"
 
 
 class OrderItem(models.Model):
-    order = models.ForeignKey(Order, on_delete=models.CASCADE)
-    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    # NOTE: the ("order", "menuitem") unique index already leads with order
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, db_index=False)
+    # Order history outlives the menu, so lines keep a snapshot of their menu
+    # item's titles from checkout (see the `backfill_order_lines` command)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.SET_NULL, null=True)
+    title = models.CharField(max_length=255, blank=True, default="")
+    category_title = models.CharField(max_length=255, blank=True, default="")
     quantity = models.SmallIntegerField(validators=[MinValueValidator(0)])
     unit_price = models.DecimalField(
         max_digits=6,
         decimal_places=2,
         validators=[MinValueValidator(decimal.Decimal("0.00"))],
     )
-    price = models.DecimalField(
-        max_digits=6,
-        decimal_places=2,
-        validators=[MinValueValidator(decimal.Decimal("0.00"))],
+    # Maintained by the database, so queryset updates keep it correct
+    price = models.GeneratedField(
+        expression=F("unit_price") * F("quantity"),
+        output_field=models.DecimalField(max_digits=6, decimal_places=2),
+        db_persist=True,
     )
+    objects = LineQuerySet.as_manager()
 
     class Meta:
         unique_together = ("order", "menuitem")
@@ -110,9 +187,124 @@ class OrderItem(models.Model):
     def get_price(self):
         return self.unit_price * self.quantity
 
-    def save(self, *args, **kwargs):
-        self.price = self.get_price()
-        super().save(*args, **kwargs)
+    def __str__(self) -> str:
+        return f"Order {self.order_id} | {self.title}"
+
+
+# NOTE: The archive tables mirror Order/OrderItem (including the ids and the
+# `orderitem_set` accessor) so the order serializers can read from them too
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="+",
+        db_index=False,
+    )
+    delivery_crew = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        null=True,
+        default=None,
+        db_index=False,
+    )
+    status = models.BooleanField(default=0)
+    total = models.DecimalField(max_digits=6, decimal_places=2)
+    date = models.DateField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "id"], name="archivedorder_user_id_idx"),
+            models.Index(
+                fields=["delivery_crew", "id"], name="archivedorder_crew_id_idx"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user} | {self.date} | {self.total}"
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(
+        ArchivedOrder,
+        on_delete=models.CASCADE,
+        related_name="orderitem_set",
+        db_index=False,
+    )
+    menuitem = models.ForeignKey(
+        MenuItem, on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    title = models.CharField(max_length=255, blank=True, default="")
+    category_title = models.CharField(max_length=255, blank=True, default="")
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+
+    class Meta:
+        unique_together = ("order", "menuitem")
+
+    def __str__(self) -> str:
+        return f"Order {self.order_id} | {self.title}"
+
+
+class StockShard(models.Model):
+    """
+    One of the counters a limited menu item's stock for the day is split
+    across, so that concurrent checkouts take from different rows
+    """
+
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField(db_index=True)
+    shard = models.PositiveSmallIntegerField()
+    remaining = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ("menuitem", "date", "shard")
 
     def __str__(self) -> str:
-        return f"Order {self.order.id} | {self.menuitem.title}"
+        return f"{self.menuitem_id} | {self.date} | {self.shard}: {self.remaining}"
+
+
+class Job(models.Model):
+    """Background task run by the `run_jobs` worker (see jobs.py)"""
+
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [(PENDING, "Pending"), (DONE, "Done"), (FAILED, "Failed")]
+
+    task = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    # Jobs enqueued again with the key of an existing job are dropped
+    key = models.CharField(max_length=255, null=True, unique=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the pending jobs that are due, oldest first
+            models.Index(fields=["status", "run_at"], name="job_due_idx"),
+            models.Index(fields=["claimed_by"], name="job_claimed_by_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """Stored response to a request sent with an Idempotency-Key"""
+
+    # Digest of the user, method, path and header value
+    key = models.CharField(max_length=40, primary_key=True)
+    # Digest of the request body, which retries must repeat
+    fingerprint = models.CharField(max_length=40)
+    # None while the first request is in progress
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True)
+    expires = models.DateTimeField(db_index=True)
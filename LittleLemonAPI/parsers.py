@@ -0,0 +1,27 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from . import renderers
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parses MessagePack-serialized data.
+
+    Prices should be sent as strings, as MessagePackRenderer writes them, so
+    the serializers' DecimalFields read them exactly.
+    """
+
+    media_type = "application/msgpack"
+    renderer_class = renderers.MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except ValueError as exc:
+            raise ParseError(f"MessagePack parse error - {exc}")
@@ -16,8 +16,15 @@ class IsDeliveryCrew(BasePermission):
     groups = ["Delivery Crew"]
 
 
-def in_group(request, groups: list[str]):
-    return request.user.groups.filter(name__in=groups)
+def user_groups(request) -> set[str]:
+    """The names of the user's groups, fetched once per request"""
+    if not hasattr(request, "user_groups"):
+        request.user_groups = set(request.user.groups.values_list("name", flat=True))
+    return request.user_groups
+
+
+def in_group(request, groups: list[str]) -> bool:
+    return not user_groups(request).isdisjoint(groups)
 
 
 def is_manager(request):
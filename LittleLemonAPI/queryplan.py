@@ -0,0 +1,35 @@
+import re
+
+from django.db import connection
+
+# Tables expected to grow without bound. A full scan or a temporary sort on
+# any of these is treated as a problem by `plan_problems`.
+LARGE_TABLES = [
+    "LittleLemonAPI_cart",
+    "LittleLemonAPI_order",
+    "LittleLemonAPI_orderitem",
+]
+
+TABLE_PATTERN = re.compile(r"^(SCAN|SEARCH) (\S+)")
+
+
+def explain(sql: str, params=None, using=connection) -> list[str]:
+    """Return the detail column of `EXPLAIN QUERY PLAN` for a statement"""
+    with using.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(plan: list[str], tables: list[str] = LARGE_TABLES) -> list[str]:
+    """Return the plan steps that scan a large table or sort one in a temp b-tree"""
+    problems = []
+    touches_large_table = False
+    for detail in plan:
+        match = TABLE_PATTERN.match(detail)
+        if match and match.group(2) in tables:
+            touches_large_table = True
+            if match.group(1) == "SCAN":
+                problems.append(detail)
+    if touches_large_table:
+        problems += [d for d in plan if d.startswith("USE TEMP B-TREE")]
+    return problems
@@ -0,0 +1,77 @@
+import decimal
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+
+    Anything orjson doesn't handle natively (Decimal, Promise, datetime, ...) is
+    passed to DRF's encoder so the output matches the stock renderer. Indented
+    output (e.g. for the browsable API) and non-default JSON settings fall back
+    to it.
+    """
+
+    if orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def uses_defaults(self):
+        """orjson only produces strict, compact, unescaped unicode output"""
+        return self.strict and self.compact and not self.ensure_ascii
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        if orjson is None or indent is not None or not self.uses_defaults():
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(
+            data,
+            default=self.encoder_class().default,
+            option=self.options,
+        )
+
+        # Match JSONRenderer, which escapes these so the output is a strict
+        # javascript subset
+        return ret.replace("\u2028".encode(), b"\\u2028").replace(
+            "\u2029".encode(), b"\\u2029"
+        )
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renderer which serializes to MessagePack.
+
+    Decimals are written as strings, matching how the serializers already
+    coerce decimal fields, so prices round-trip without loss.
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        return encoders.JSONEncoder().default(obj)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=self.default, use_bin_type=True)
@@ -1,11 +1,92 @@
 import bleach
 from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
 from . import models
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Trims the output of read requests to the fields listed in `?fields=` or
+    without those listed in `?omit=` (comma separated).
+
+    `prune_queryset` pushes the remaining fields down to the queryset so the
+    columns and joins of omitted fields aren't fetched.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.trimmed = False
+
+        request = self.context.get("request")
+        if request is None or request.method not in SAFE_METHODS:
+            return
+
+        fields = split_param(request.query_params.get("fields"))
+        omit = split_param(request.query_params.get("omit"))
+        if not fields and not omit:
+            return
+
+        for name in list(self.fields):
+            if (fields and name not in fields) or name in omit:
+                self.fields.pop(name)
+                self.trimmed = True
+
+    def prune_queryset(self, queryset):
+        if not self.trimmed or not isinstance(queryset, QuerySet):
+            return queryset
+
+        pushdown = get_pushdown(self)
+        if pushdown is None:
+            return queryset
+
+        only, related = pushdown
+        queryset = queryset.select_related(None).only(*only)
+        # NOTE: select_related() without arguments would follow every relation
+        return queryset.select_related(*related) if related else queryset
+
+
+def split_param(value: str | None) -> set[str]:
+    return {name.strip() for name in value.split(",")} if value else set()
+
+
+def get_pushdown(serializer, prefix: str = ""):
+    """
+    Return the model fields to load and the relations to join in order to
+    render `serializer`, or None when that can't be determined (e.g. method
+    fields, which may touch anything). Fields listed in the serializer's
+    `Meta.annotated_fields` come from queryset annotations and are skipped.
+    """
+    only, related = [], []
+    model = serializer.Meta.model
+    annotated = getattr(serializer.Meta, "annotated_fields", [])
+    for field in serializer.fields.values():
+        # Annotations are computed by the query, not loaded from a column
+        if field.write_only or field.field_name in annotated:
+            continue
+        if len(field.source_attrs) != 1:
+            return None
+
+        name = field.source_attrs[0]
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+        only.append(prefix + name)
+        if model_field.is_relation and isinstance(field, serializers.ModelSerializer):
+            nested = get_pushdown(field, prefix=f"{prefix}{name}__")
+            if nested is None:
+                return None
+            only += nested[0]
+            related += [prefix + name, *nested[1]]
+    return only, related
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["id", "username"]
@@ -16,7 +97,7 @@ class UserSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Category
         fields = ["id", "slug", "title"]
@@ -27,13 +108,25 @@ class CategorySerializer(serializers.ModelSerializer):
         return attrs
 
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.IntegerField(write_only=True)
+    # Left today, where the queryset is annotated `with_availability()`
+    available = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = models.MenuItem
-        fields = ["id", "title", "price", "featured", "category", "category_id"]
+        fields = [
+            "id",
+            "title",
+            "price",
+            "featured",
+            "category",
+            "category_id",
+            "daily_limit",
+            "available",
+        ]
+        annotated_fields = ["available"]
 
     def validate(self, attrs):
         for k in ["title"]:
@@ -41,7 +134,7 @@ class MenuItemSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(default=serializers.CurrentUserDefault())
     menuitem = MenuItemSerializer(read_only=True)
     menuitem_id = serializers.IntegerField(write_only=True)
@@ -55,7 +148,7 @@ class CartSerializer(serializers.ModelSerializer):
         return cart.quantity * cart.unit_price
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(default=serializers.CurrentUserDefault())
     delivery_crew = UserSerializer(read_only=True)
     delivery_crew_id = serializers.IntegerField(write_only=True)
@@ -72,7 +165,37 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderLineSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Compact order item, read from the order item table alone, nested under
+    ExpandedOrderSerializer and listed by SingleOrderView
+    """
+
+    menuitem_id = serializers.IntegerField(read_only=True)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = models.OrderItem
+        fields = [
+            "menuitem_id",
+            "title",
+            "category_title",
+            "quantity",
+            "unit_price",
+            "price",
+        ]
+
+
+class ExpandedOrderSerializer(OrderSerializer):
+    """Order with its items, for `?expand=items`"""
+
+    items = OrderLineSerializer(source="orderitem_set", many=True, read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        fields = ["id", *OrderSerializer.Meta.fields, "items"]
+
+
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     order = OrderSerializer(read_only=True)
     order_id = serializers.IntegerField(write_only=True)
     menuitem = MenuItemSerializer(read_only=True)
@@ -86,10 +209,30 @@ class OrderItemSerializer(serializers.ModelSerializer):
             "order_id",
             "menuitem",
             "menuitem_id",
+            "title",
+            "category_title",
             "quantity",
             "unit_price",
             "price",
         ]
+        read_only_fields = ["title", "category_title"]
+
+    def calculate_price(self, item: models.OrderItem):
+        return item.unit_price * item.quantity
+
+
+class BulkOrderUpdateSerializer(serializers.Serializer):
+    """One change applied to several orders by `OrderView.bulk_update`"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=500
+    )
+    status = serializers.BooleanField(required=False)
+    delivery_crew_id = serializers.IntegerField(required=False, allow_null=True)
 
-    def calculate_price(self):
-        return self.unit_price * self.quantity
+    def validate(self, data):
+        if "status" not in data and "delivery_crew_id" not in data:
+            raise serializers.ValidationError(
+                "Provide a status or a delivery_crew_id to apply"
+            )
+        return data
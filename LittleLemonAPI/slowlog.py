@@ -0,0 +1,127 @@
+"""
+Slow-query log.
+
+With SLOW_QUERY_LOG enabled, SlowQueryMiddleware times every statement a
+request runs and appends those taking at least SLOW_QUERY_THRESHOLD seconds to
+SLOW_QUERY_LOG_FILE, one JSON object per line. Each entry has the view, the
+statement with its literals and parameters replaced by `?`, a fingerprint of
+that text, the duration and the statement's `EXPLAIN QUERY PLAN`.
+
+The file is shared by all processes. `python manage.py slow_queries` sums it
+up per fingerprint.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+
+from .queryplan import explain
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+VALUE_LISTS = re.compile(r"\(\?(?:, \?)+\)")
+WHITESPACE = re.compile(r"\s+")
+
+write_lock = threading.Lock()
+
+
+def normalize(sql: str) -> str:
+    """Replace the literals and parameters of a statement with `?`"""
+    sql = LITERALS.sub("?", WHITESPACE.sub(" ", sql).strip())
+    # IN lists differ in length from one call to the next
+    return VALUE_LISTS.sub("(...)", sql)
+
+
+def fingerprint(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+class SlowQueryRecorder:
+    """Database execute wrapper logging the slow statements of one request"""
+
+    # Plans are captured once per fingerprint per process
+    plans: dict[str, list[str]] = {}
+
+    def __init__(self, request):
+        self.request = request
+        self.threshold = getattr(settings, "SLOW_QUERY_THRESHOLD", 0.1)
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - start
+        if duration >= self.threshold:
+            self.record(sql, params, many, duration)
+        return result
+
+    def view(self) -> str:
+        # URL name, or the view's dotted path for unnamed routes
+        match = self.request.resolver_match
+        return match.view_name if match else self.request.path_info
+
+    def plan(self, key: str, sql: str, params, many: bool) -> list[str]:
+        if key not in self.plans:
+            if many or connection.vendor != "sqlite":
+                return []
+            self.explaining = True
+            try:
+                self.plans[key] = explain(sql, params)
+            except Exception:
+                # e.g. the statement left the transaction unusable
+                return []
+            finally:
+                self.explaining = False
+        return self.plans[key]
+
+    def record(self, sql: str, params, many: bool, duration: float):
+        normalized = normalize(sql)
+        key = fingerprint(normalized)
+        entry = {
+            "time": now().isoformat(),
+            "view": self.view(),
+            "fingerprint": key,
+            "sql": normalized,
+            "duration": round(duration * 1000, 3),
+            "plan": self.plan(key, sql, params, many),
+        }
+        with write_lock, open(settings.SLOW_QUERY_LOG_FILE, "a") as log:
+            log.write(json.dumps(entry) + "\n")
+
+
+def read_log(path) -> list[dict]:
+    with open(path) as log:
+        return [json.loads(line) for line in log if line.strip()]
+
+
+def aggregate(entries: list[dict]) -> list[dict]:
+    """Sum up log entries per fingerprint"""
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(
+            entry["fingerprint"],
+            {
+                "fingerprint": entry["fingerprint"],
+                "sql": entry["sql"],
+                "views": set(),
+                "count": 0,
+                "total": 0.0,
+                "max": 0.0,
+                "plan": [],
+            },
+        )
+        group["views"].add(entry["view"])
+        group["count"] += 1
+        group["total"] += entry["duration"]
+        if entry["duration"] >= group["max"]:
+            group["max"] = entry["duration"]
+            group["plan"] = entry["plan"] or group["plan"]
+    return list(groups.values())
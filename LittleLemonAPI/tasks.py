@@ -0,0 +1,38 @@
+"""Tasks run in the background by the `run_jobs` worker (see jobs.py)"""
+
+from django.core.mail import EmailMessage
+from django.utils.timezone import now
+
+from .models import Order, OrderItem
+from .writes import write
+
+
+def send_receipt(order_id: int):
+    """Email the customer a receipt for their order, unless it was sent"""
+    order = Order.objects.select_related("user").filter(id=order_id).first()
+    # The order may have been deleted since checkout
+    if order is None or not order.user.email:
+        return
+    # Marked before sending, in a write of its own, so that runs of the job
+    # overlapping after a lease expired send one receipt. A worker dying
+    # between the two loses the receipt rather than sending it twice.
+    unsent = Order.objects.filter(id=order_id, receipt_sent=None)
+    if not write(lambda: unsent.update(receipt_sent=now())):
+        return
+
+    items = OrderItem.objects.filter(order_id=order_id)
+    lines = [
+        f"{item.quantity} x {item.title}: {item.price}"
+        for item in items.order_by("id")
+    ]
+    try:
+        EmailMessage(
+            f"Your Little Lemon order #{order.id}",
+            "\n".join([*lines, f"Total: {order.total}"]),
+            None,
+            [order.user.email],
+        ).send()
+    except Exception:
+        # Let the job's retry send it
+        write(lambda: Order.objects.filter(id=order_id).update(receipt_sent=None))
+        raise
@@ -1,19 +1,71 @@
 import datetime as dt
+import decimal
+import gzip
+import hashlib
+import importlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
 from django.contrib.auth.models import Group, User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.timezone import localdate, now
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITestCase
-
-from . import models
+from rest_framework.decorators import api_view
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+
+from LittleLemon import startup
+
+from . import (
+    admin,
+    admission,
+    autocomplete,
+    catalog,
+    coalesce,
+    idempotency,
+    inventory,
+    jobs,
+    metrics,
+    middleware,
+    models,
+    queryplan,
+    renderers,
+    slowlog,
+    tasks,
+    views,
+    writes,
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 MANAGER = dict(username="Woody", password="tomhanks")
 CUSTOMER = dict(username="Buzz", password="timallen")
 
 
-class RubricTest(APITestCase):
+class LittleLemonTestCase(APITestCase):
     def setUp(self):
+        # Throttle history lives in the cache and would leak between tests
+        cache.clear()
 
         group_manager = Group.objects.create(name="Manager")
         group_crew = Group.objects.create(name="Delivery Crew")
@@ -74,6 +126,8 @@ class RubricTest(APITestCase):
             order_items.append(
                 models.OrderItem.objects.create(
                     **x,
+                    title=x["menuitem"].title,
+                    category_title=x["menuitem"].category.title,
                     unit_price=x["menuitem"].price,
                     price=x["quantity"] * x["menuitem"].price,
                 )
@@ -98,6 +152,8 @@ class RubricTest(APITestCase):
         Token.objects.create(user=woody)
         Token.objects.create(user=bo_peep)
 
+
+class RubricTest(LittleLemonTestCase):
     def test_01(self):
         """The admin can assign users to the manager group"""
         url = "/api/groups/manager/users"
@@ -378,3 +434,1444 @@ class RubricTest(APITestCase):
 
         for data in response.data["results"]:
             self.assertEqual(data["user"]["username"], user.username, response.data)
+
+
+class QueryPlanTest(LittleLemonTestCase):
+    """Endpoints must not full-scan or temp-sort the tables that grow with use"""
+
+    def assertIndexedPlans(self, method, url, user):
+        token = Token.objects.get(user__username=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 400, response)
+
+        for query in ctx.captured_queries:
+            if not query["sql"].startswith("SELECT"):
+                continue
+            plan = queryplan.explain(query["sql"])
+            problems = queryplan.plan_problems(plan)
+            self.assertEqual(problems, [], f"{query['sql']}\n{plan}")
+
+    def test_orders_customer(self):
+        self.assertIndexedPlans("get", "/api/orders", CUSTOMER["username"])
+
+    def test_orders_delivery_crew(self):
+        self.assertIndexedPlans("get", "/api/orders", "Slinky")
+
+    def test_cart(self):
+        self.assertIndexedPlans("get", "/api/cart/menu-items", CUSTOMER["username"])
+
+    def test_single_order(self):
+        self.assertIndexedPlans("get", "/api/orders/1", CUSTOMER["username"])
+
+    def test_checkout(self):
+        self.assertIndexedPlans("post", "/api/orders", CUSTOMER["username"])
+
+    def test_plan_problems(self):
+        """The checker flags scans and temp sorts of large tables"""
+        for queryset in [
+            models.Order.objects.filter(total=32),
+            models.Order.objects.filter(user__username="Buzz").order_by("total"),
+        ]:
+            plan = queryplan.explain(*queryset.query.sql_with_params())
+            self.assertNotEqual(queryplan.plan_problems(plan), [], plan)
+
+
+class RendererTest(LittleLemonTestCase):
+    def test_fast_json_matches_json(self):
+        """The fast renderer produces the same bytes as DRF's renderer"""
+        data = {
+            "price": decimal.Decimal("7.50"),
+            "date": dt.date(2024, 5, 1),
+            "created": dt.datetime(2024, 5, 1, 12, 30, tzinfo=dt.timezone.utc),
+            "items": [{"title": "Bruschetta \u2028"}],
+            1: None,
+        }
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(data),
+            JSONRenderer().render(data),
+        )
+
+    @override_settings(COMPRESSION_MIN_SIZE=200)
+    def test_large_responses_are_compressed(self):
+        url = "/api/menu-items"
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn(b'"title":"Beef Pasta"', gzip.decompress(response.content))
+
+        response = self.client.get(url)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get("/api/categories", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    @override_settings(COMPRESSION_MIN_SIZE=200)
+    def test_refused_encodings(self):
+        """Codings sent with q=0 are not used"""
+        url = "/api/menu-items"
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="br;q=0, gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=0, *")
+        self.assertNotEqual(response.get("Content-Encoding"), "gzip")
+
+        self.assertEqual(
+            middleware.choose_encoding("gzip;q=0.5, br", ["br", "gzip"]), "br"
+        )
+        self.assertEqual(
+            middleware.choose_encoding("gzip, br;q=0.5", ["br", "gzip"]), "gzip"
+        )
+        self.assertEqual(middleware.choose_encoding("*", ["br", "gzip"]), "br")
+        self.assertIsNone(middleware.choose_encoding("identity", ["br", "gzip"]))
+
+    def test_pages_are_padded(self):
+        """Pages with a CSRF token get GZipMiddleware's random padding"""
+        self.client.force_login(
+            User.objects.create_superuser(username="Andy", password="johnmorris")
+        )
+        bodies = set()
+        for _ in range(5):
+            response = self.client.get("/admin/", HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertIn(b"csrfmiddlewaretoken", gzip.decompress(response.content))
+            bodies.add(len(response.content))
+        self.assertGreater(len(bodies), 1)
+
+
+@unittest.skipIf(msgpack is None, "msgpack is not installed")
+class MessagePackTest(LittleLemonTestCase):
+    def authenticate(self, username):
+        token = Token.objects.get(user__username=username)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def test_render(self):
+        """Orders can be requested as MessagePack with exact totals"""
+        self.authenticate(CUSTOMER["username"])
+        response = self.client.get("/api/orders", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+
+        data = msgpack.unpackb(response.content)
+        self.assertEqual(data["results"][0]["total"], "32.00")
+
+    def test_parse(self):
+        """Cart items can be posted as MessagePack without losing precision"""
+        self.authenticate(CUSTOMER["username"])
+        response = self.client.post(
+            "/api/cart/menu-items",
+            msgpack.packb(dict(menuitem_id=5, quantity=3, unit_price="7.50")),
+            content_type="application/msgpack",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        cart = models.Cart.objects.get(user__username=CUSTOMER["username"], menuitem=5)
+        self.assertEqual(cart.price, decimal.Decimal("22.50"))
+
+
+class SparseFieldsTest(LittleLemonTestCase):
+    def test_fields(self):
+        """Only the requested fields are rendered and fetched"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/menu-items?fields=id,title,price")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for data in response.data["results"]:
+            self.assertEqual(list(data), ["id", "title", "price"])
+
+        sql = ctx.captured_queries[-1]["sql"]
+        self.assertNotIn("LittleLemonAPI_category", sql)
+        self.assertNotIn("featured", sql)
+
+    def test_omit(self):
+        """Omitted nested objects are not joined"""
+        token = Token.objects.get(user__username=MANAGER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/orders?omit=user,delivery_crew")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for data in response.data["results"]:
+            self.assertEqual(list(data), ["status", "total", "date"])
+
+        sql = ctx.captured_queries[-1]["sql"]
+        self.assertNotIn("auth_user", sql)
+
+    def test_omit_with_annotations(self):
+        """Annotated fields don't stop omitted relations from being pruned"""
+        models.MenuItem.objects.filter(id=1).update(daily_limit=5)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/menu-items?omit=category")
+        self.assertEqual(response.data["results"][0]["available"], 5)
+        self.assertNotIn("category", response.data["results"][0])
+
+        sql = ctx.captured_queries[-1]["sql"]
+        self.assertNotIn("LittleLemonAPI_category", sql)
+
+
+class ExpandOrderItemsTest(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def test_expand_items(self):
+        """Orders are listed with their items and menu item titles"""
+        response = self.client.get("/api/orders?expand=items")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        order = response.data["results"][0]
+        self.assertEqual(order["id"], 1)
+        self.assertEqual(
+            [item["title"] for item in order["items"]],
+            ["Beef Pasta", "Cheese Sticks", "Negroni"],
+        )
+        self.assertEqual(order["items"][0]["price"], "12.00")
+
+    def test_query_count_is_fixed(self):
+        """A full page takes as many queries as a page with one order"""
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get("/api/orders?expand=items")
+        single = len(ctx.captured_queries)
+
+        buzz = User.objects.get(username=CUSTOMER["username"])
+        for menuitem in models.MenuItem.objects.all()[:3]:
+            order = models.Order.objects.create(user=buzz, total=menuitem.price)
+            models.OrderItem.objects.create(
+                order=order, menuitem=menuitem, quantity=1, unit_price=menuitem.price
+            )
+
+        with self.assertNumQueries(single):
+            response = self.client.get("/api/orders?expand=items")
+        self.assertEqual(len(response.data["results"]), 4)
+
+
+warmups = []
+
+
+def record_warmup():
+    warmups.append(True)
+
+
+class StartupTest(SimpleTestCase):
+    def test_import_timer(self):
+        """Imports made while the timer is installed are timed"""
+        sys.modules.pop("colorsys", None)
+        timer = startup.ImportTimer()
+        timer.install()
+        try:
+            importlib.import_module("colorsys")
+        finally:
+            timer.uninstall()
+
+        self.assertIn("colorsys", timer.times)
+        own, cumulative = timer.times["colorsys"]
+        self.assertLessEqual(own, cumulative)
+        self.assertIn("colorsys", timer.report())
+
+    # The app's own warmups need the database
+    @override_settings(STARTUP_WARMUPS=["LittleLemonAPI.tests.record_warmup"])
+    def test_warm_up(self):
+        """The warm-up hook runs the functions of STARTUP_WARMUPS"""
+        warmups.clear()
+        with mock.patch.dict(os.environ, {startup.WARMUP_ENV: "1"}):
+            with self.assertLogs("LittleLemon.startup", "INFO") as logs:
+                startup.warm_up_if_enabled()
+        self.assertEqual(warmups, [True])
+        self.assertIn("URL patterns", logs.output[0])
+        self.assertIn("warmed up in", logs.output[-1])
+
+
+class AdminTest(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(
+            User.objects.create_superuser(username="Andy", password="johnmorris")
+        )
+
+    def add_orders(self, count):
+        buzz = User.objects.get(username=CUSTOMER["username"])
+        crew = User.objects.get(username="Rex")
+        menuitem = models.MenuItem.objects.first()
+        for _ in range(count):
+            order = models.Order.objects.create(
+                user=buzz, delivery_crew=crew, total=menuitem.price
+            )
+            models.OrderItem.objects.create(
+                order=order, menuitem=menuitem, quantity=1, unit_price=menuitem.price
+            )
+
+    def test_changelists(self):
+        """Changelist queries don't grow with the number of rows shown"""
+        for model in ["cart", "category", "menuitem", "order", "orderitem"]:
+            url = f"/admin/LittleLemonAPI/{model}/"
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            self.add_orders(5)
+            with self.assertNumQueries(len(ctx.captured_queries)):
+                self.client.get(url)
+
+    def test_estimated_count(self):
+        """Large unfiltered changelists are counted from the statistics"""
+        self.add_orders(3)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        models.Order.objects.filter(id__gt=2).delete()
+        paginator = admin.EstimatedCountPaginator(
+            models.Order.objects.order_by("id"), 100
+        )
+        paginator.exact_below = 0
+        # As of the last ANALYZE
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, 5)
+
+        paginator = admin.EstimatedCountPaginator(
+            models.Order.objects.filter(status=True).order_by("id"), 100
+        )
+        paginator.exact_below = 0
+        self.assertEqual(paginator.count, 0)
+
+    def test_exact_count(self):
+        """Small tables, and tables not analyzed yet, are counted exactly"""
+        paginator = admin.EstimatedCountPaginator(
+            models.MenuItem.objects.order_by("id"), 100
+        )
+        paginator.exact_below = 0
+        self.assertEqual(paginator.count, 6)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        paginator = admin.EstimatedCountPaginator(
+            models.MenuItem.objects.order_by("id"), 100
+        )
+        self.assertEqual(paginator.count, 6)
+
+
+class ArchiveTest(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        # Delivered yesterday, so it is archived with a cutoff of today
+        models.Order.objects.filter(id=1).update(status=True)
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def test_archive_orders(self):
+        """Old delivered orders move to the archive tables"""
+        call_command("archive_orders", days=0, batch_size=1, stdout=io.StringIO())
+
+        self.assertFalse(models.Order.objects.filter(id=1).exists())
+        self.assertFalse(models.OrderItem.objects.filter(order_id=1).exists())
+        self.assertTrue(models.Order.objects.filter(id=2).exists())
+        self.assertEqual(models.ArchivedOrderItem.objects.filter(order_id=1).count(), 3)
+
+        order = models.ArchivedOrder.objects.get(id=1)
+        self.assertEqual(order.total, 32)
+        self.assertEqual(order.delivery_crew.username, "Slinky")
+
+    def test_read_archive(self):
+        """The archive is only read when asked for"""
+        call_command("archive_orders", days=0, stdout=io.StringIO())
+
+        response = self.client.get("/api/orders")
+        self.assertEqual(response.data["results"], [])
+
+        response = self.client.get("/api/orders?archived=true&expand=items")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(len(response.data["results"][0]["items"]), 3)
+
+        response = self.client.get("/api/orders/1")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/orders/1?archived=true")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+
+
+class OrderSnapshotTest(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def test_checkout(self):
+        """Checkout records the titles, which outlive the menu item"""
+        self.client.post("/api/orders")
+        order = models.Order.objects.latest("id")
+        self.assertEqual(
+            list(order.orderitem_set.values_list("title", "category_title")),
+            [("Beef Pasta", "Main"), ("Cheese Sticks", "Appetizer")],
+        )
+
+        models.MenuItem.objects.filter(title="Beef Pasta").update(title="Lasagna")
+        models.MenuItem.objects.get(title="Cheese Sticks").delete()
+        response = self.client.get(f"/api/orders/{order.id}")
+        self.assertCountEqual(
+            [(line["menuitem_id"], line["title"]) for line in response.data],
+            [(1, "Beef Pasta"), (None, "Cheese Sticks")],
+        )
+
+    def test_retrieve_reads_order_lines(self):
+        """An order's lines are read without joining the menu"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/orders/1")
+        self.assertIn("Drink", [line["category_title"] for line in response.data])
+        sql = " ".join(query["sql"] for query in ctx.captured_queries)
+        self.assertNotIn('"LittleLemonAPI_menuitem"', sql)
+        self.assertNotIn('"LittleLemonAPI_category"', sql)
+
+    def test_backfill(self):
+        models.OrderItem.objects.update(title="", category_title="")
+        call_command("backfill_order_lines", batch_size=4, stdout=io.StringIO())
+        self.assertEqual(
+            list(
+                models.OrderItem.objects.filter(order_id=2)
+                .order_by("id")
+                .values_list("title", "category_title")
+            ),
+            [
+                ("Bruschetta", "Main"),
+                ("Greek Salad", "Appetizer"),
+                ("Bellini", "Drink"),
+            ],
+        )
+
+
+class CoalesceViewTest(TransactionTestCase):
+    def test_concurrent_menu_requests(self):
+        """Concurrent identical GETs of the menu run its query once"""
+        category = models.Category.objects.create(title="Main", slug="main")
+        models.MenuItem.objects.create(
+            title="Bruschetta", price=5, featured=False, category=category
+        )
+        cache.clear()
+        queries, statuses = [], []
+        release = threading.Event()
+        filter_queryset = views.MenuItemsView.filter_queryset
+
+        def slow_filter_queryset(view, queryset):
+            queries.append(True)
+            release.wait(5)
+            return filter_queryset(view, queryset)
+
+        def get():
+            statuses.append(APIClient().get("/api/menu-items").status_code)
+            connection.close()
+
+        coalesced = coalesce.flight.stats["coalesced"]
+        threads = [threading.Thread(target=get) for _ in range(5)]
+        with mock.patch.object(
+            views.MenuItemsView, "filter_queryset", slow_filter_queryset
+        ):
+            for thread in threads:
+                thread.start()
+            deadline = time.monotonic() + 5
+            while coalesce.flight.stats["coalesced"] < coalesced + 4:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(queries, [True])
+        self.assertEqual(statuses, [status.HTTP_200_OK] * 5)
+
+
+class CoalesceTest(LittleLemonTestCase):
+    def test_single_flight(self):
+        """Concurrent calls with the same key share one execution"""
+        flight = coalesce.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def work():
+            calls.append(True)
+            started.set()
+            release.wait()
+            return "menu"
+
+        leader = threading.Thread(target=lambda: results.append(flight.do("k", work)))
+        leader.start()
+        started.wait()
+        followers = [
+            threading.Thread(target=lambda: results.append(flight.do("k", work)))
+            for _ in range(4)
+        ]
+        for thread in followers:
+            thread.start()
+        while flight.stats["coalesced"] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join()
+
+        self.assertEqual(calls, [True])
+        self.assertEqual(results, ["menu"] * 5)
+        self.assertEqual(flight.stats, {"executed": 1, "coalesced": 4, "shared": 0})
+
+        # Nothing is kept once the call finishes
+        self.assertEqual(flight.do("k", lambda: "new menu"), "new menu")
+
+    def test_across_processes(self):
+        """Without the lock, a process waits for the holder's published result"""
+        key = "http://testserver/api/categories"
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        token = coalesce.acquire(digest, timeout=5)
+        self.assertIsNotNone(token)
+        cache.set(f"coalesce:{digest}", ["shared"])
+
+        with self.assertNumQueries(0):
+            result = coalesce.across_processes(key, lambda: ["executed"])
+        self.assertEqual(result, ["shared"])
+
+        coalesce.release(digest, token)
+        result = coalesce.across_processes(key, lambda: ["executed"])
+        self.assertEqual(result, ["executed"])
+        self.assertIsNone(cache.get(f"coalesce:lock:{digest}"))
+
+    def test_views(self):
+        """Coalesced views still see menu changes between requests"""
+        self.client.get("/api/menu-items")
+        models.MenuItem.objects.filter(id=1).update(title="Lasagna")
+        response = self.client.get("/api/menu-items")
+        self.assertEqual(response.data["results"][0]["title"], "Lasagna")
+
+
+class LeanMiddlewareTest(LittleLemonTestCase):
+    def test_token_api_requests(self):
+        """Token-authenticated API requests skip the session-based middleware"""
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        response = self.client.get("/api/cart/menu-items")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.wsgi_request.lean_middleware)
+        self.assertFalse(hasattr(response.wsgi_request, "session"))
+        self.assertFalse(response.has_header("X-Frame-Options"))
+
+    def test_admin_requests(self):
+        """The admin keeps the full middleware stack"""
+        self.client.force_login(User.objects.get(username=MANAGER["username"]))
+        response = self.client.get("/admin/")
+        self.assertFalse(response.wsgi_request.lean_middleware)
+        self.assertTrue(hasattr(response.wsgi_request, "session"))
+        self.assertTrue(response.has_header("X-Frame-Options"))
+
+    def test_session_api_requests(self):
+        """API requests authenticated by a session keep the full stack"""
+        self.client.force_login(User.objects.get(username=CUSTOMER["username"]))
+        response = self.client.get("/api/cart/menu-items")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.wsgi_request.lean_middleware)
+
+
+@override_settings(CART_STORAGE="LittleLemonAPI.carts.CacheCartStore")
+class CacheCartStoreTest(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        token = Token.objects.get(user__username="Bo_Peep")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def test_cart_and_checkout(self):
+        """Carts live in the cache until checkout writes the order"""
+        url = "/api/cart/menu-items"
+        for menuitem_id, quantity in [(4, 2), (6, 1)]:
+            response = self.client.post(
+                url,
+                dict(menuitem_id=menuitem_id, quantity=quantity, unit_price="10.00"),
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data["menuitem"]["id"], menuitem_id)
+        self.assertFalse(models.Cart.objects.filter(user__username="Bo_Peep").exists())
+
+        response = self.client.get(url)
+        self.assertEqual(
+            [item["price"] for item in response.data["results"]],
+            [decimal.Decimal("20.00"), decimal.Decimal("10.00")],
+        )
+
+        response = self.client.post("/api/orders")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = models.Order.objects.filter(user__username="Bo_Peep").last()
+        self.assertEqual(order.total, 30)
+        self.assertEqual(order.orderitem_set.count(), 2)
+
+        response = self.client.get(url)
+        self.assertEqual(response.data["results"], [])
+
+
+class LinePriceTest(LittleLemonTestCase):
+    def test_bulk_updates_keep_prices(self):
+        """Line prices follow queryset updates of quantity and unit price"""
+        cart = models.Cart.objects.filter(user__username=CUSTOMER["username"])
+        cart.set_quantity(3)
+        self.assertEqual(
+            sorted(models.Cart.objects.values_list("price", flat=True)),
+            [decimal.Decimal("15.00"), decimal.Decimal("18.00")],
+        )
+
+        items = models.OrderItem.objects.filter(order_id=1)
+        items.update(unit_price=1)
+        self.assertEqual(
+            list(items.values_list("price", flat=True)), [decimal.Decimal("2.00")] * 3
+        )
+
+    def test_adjust_price(self):
+        """A menu price change reprices the open carts holding the item"""
+        call_command(
+            "adjust_prices", factor="1.10", category="Main", stdout=io.StringIO()
+        )
+
+        menuitem = models.MenuItem.objects.get(id=1)
+        self.assertEqual(menuitem.price, decimal.Decimal("6.60"))
+        self.assertEqual(models.MenuItem.objects.get(id=2).price, 5)
+        cart = models.Cart.objects.get(menuitem=1)
+        self.assertEqual(cart.unit_price, decimal.Decimal("6.60"))
+        self.assertEqual(cart.price, decimal.Decimal("13.20"))
+        self.assertEqual(models.Cart.objects.get(menuitem=2).price, 10)
+
+    def test_adjust_price_filtered_on_price(self):
+        """Carts are repriced for the items matched before the update"""
+        models.MenuItem.objects.filter(price__lt=7).adjust_price(3)
+        self.assertEqual(
+            models.Cart.objects.get(menuitem=1).unit_price, decimal.Decimal("18.00")
+        )
+
+
+class AdmissionTest(LittleLemonTestCase):
+    def test_classes(self):
+        """Method-specific routes take precedence over the bare URL name"""
+        classes = admission.get_admission()
+        self.assertEqual(classes.gate("GET", "menu-items").name, "catalog")
+        self.assertEqual(classes.gate("HEAD", "menu-items").name, "catalog")
+        self.assertEqual(classes.gate("POST", "menu-items").name, "staff")
+        self.assertEqual(classes.gate("POST", "orders").name, "checkout")
+        self.assertEqual(classes.gate("GET", "orders").name, "orders")
+        self.assertIsNone(classes.gate("GET", None))
+
+    @override_settings(
+        ADMISSION_CLASSES={
+            "catalog": {
+                "routes": ["GET menu-items"],
+                "limit": 1,
+                "timeout": 0,
+                "retry_after": 3,
+            }
+        }
+    )
+    def test_shed(self):
+        """Requests beyond the limit are rejected once the deadline passes"""
+        gate = admission.get_admission().gates["catalog"]
+        self.assertTrue(gate.acquire())
+        response = self.client.get("/api/menu-items")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "3")
+
+        # A slot freed while waiting admits the request
+        gate.timeout = 5
+        threading.Timer(0.05, gate.release).start()
+        response = self.client.get("/api/menu-items")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(
+            admission.get_admission().snapshot()["catalog"],
+            {"limit": 1, "in_flight": 0, "waiting": 0, "admitted": 2, "shed": 1},
+        )
+
+    def test_stats(self):
+        """Managers can read the per-class counts"""
+        token = Token.objects.get(user__username=MANAGER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        response = self.client.get("/api/admission")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {"catalog", "checkout", "orders", "staff"})
+
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        response = self.client.get("/api/admission")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+def failing_task(**payload):
+    raise ValueError("task failed")
+
+
+class JobTest(LittleLemonTestCase):
+    def test_checkout_enqueues_receipt(self):
+        """Checkout leaves the receipt to the worker"""
+        User.objects.filter(username=CUSTOMER["username"]).update(
+            email="buzz@example.com"
+        )
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        response = self.client.post("/api/orders")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(mail.outbox, [])
+
+        order = models.Order.objects.filter(user__username=CUSTOMER["username"]).last()
+        job = models.Job.objects.get(key=f"receipt:{order.id}")
+        self.assertEqual(job.payload, {"order_id": order.id})
+        # Enqueueing the same side effect again is a no-op
+        self.assertIsNone(jobs.enqueue(job.task, key=job.key, order_id=order.id))
+
+        call_command("run_jobs", once=True, stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(f"Total: {order.total}", mail.outbox[0].body)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (models.Job.DONE, 1))
+
+    def test_failed_checkout_keeps_nothing(self):
+        """A checkout failing after the order is written leaves no trace"""
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        orders = models.Order.objects.count()
+        with mock.patch("LittleLemonAPI.views.enqueue", side_effect=ValueError("no")):
+            response = self.client.post("/api/orders")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {"message": "no"})
+        self.assertEqual(models.Order.objects.count(), orders)
+        self.assertEqual(
+            models.Cart.objects.filter(user__username=CUSTOMER["username"]).count(), 2
+        )
+
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_retries(self):
+        """Failing jobs are retried later, then marked failed"""
+        job = jobs.enqueue(failing_task)
+        self.assertEqual(job.task, "LittleLemonAPI.tests.failing_task")
+
+        [claimed] = jobs.claim(10)
+        self.assertEqual(jobs.claim(10), [])
+        self.assertFalse(jobs.run(claimed))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (models.Job.PENDING, 1))
+        self.assertGreater(job.run_at, claimed.created)
+        self.assertIn("ValueError: task failed", job.last_error)
+
+        models.Job.objects.filter(id=job.id).update(run_at=job.created)
+        [claimed] = jobs.claim(10)
+        self.assertFalse(jobs.run(claimed))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (models.Job.FAILED, 2))
+
+        self.assertEqual(jobs.retry(models.Job.objects.all()), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (models.Job.PENDING, 0))
+        self.assertEqual(jobs.claim(10), [job])
+
+    def test_purge(self):
+        """Finished and failed jobs are purged in time, freeing their keys"""
+        for state in [models.Job.DONE, models.Job.FAILED, models.Job.PENDING]:
+            models.Job.objects.create(
+                task="LittleLemonAPI.tests.failing_task",
+                key=state,
+                status=state,
+                run_at=now() - dt.timedelta(days=8),
+            )
+        self.assertEqual(jobs.purge(7), 2)
+        self.assertIsNotNone(jobs.enqueue(failing_task, key=models.Job.FAILED))
+        self.assertIsNone(jobs.enqueue(failing_task, key=models.Job.PENDING))
+
+    def test_receipt_sent_once(self):
+        """A receipt job run again doesn't send a second receipt"""
+        order = models.Order.objects.filter(user__username=CUSTOMER["username"]).first()
+        User.objects.filter(id=order.user_id).update(email="buzz@example.com")
+        job = jobs.enqueue(tasks.send_receipt, order_id=order.id)
+
+        with mock.patch("LittleLemonAPI.tasks.EmailMessage.send", side_effect=OSError):
+            self.assertFalse(jobs.run(jobs.claim(10)[0]))
+        order.refresh_from_db()
+        self.assertIsNone(order.receipt_sent)
+
+        models.Job.objects.filter(id=job.id).update(run_at=job.created)
+        self.assertTrue(jobs.run(jobs.claim(10)[0]))
+        tasks.send_receipt(order.id)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class JobTransactionTest(TransactionTestCase):
+    def test_task_outside_transaction(self):
+        """Tasks don't hold the write lock while they send email"""
+        user = User.objects.create(username="woody", email="woody@example.com")
+        order = models.Order.objects.create(user=user, total=0)
+        jobs.enqueue(tasks.send_receipt, order_id=order.id)
+
+        def send(message):
+            self.assertFalse(connection.in_atomic_block)
+            # The mark is committed before sending
+            self.assertTrue(
+                models.Order.objects.filter(receipt_sent__isnull=False).exists()
+            )
+            return 1
+
+        with mock.patch("LittleLemonAPI.tasks.EmailMessage.send", send):
+            self.assertTrue(jobs.run(jobs.claim(10)[0]))
+        self.assertEqual(models.Job.objects.get().status, models.Job.DONE)
+
+
+# The index outlives each test's rows; checking the version on every lookup
+# rebuilds it once setUp has cleared the cache
+@override_settings(AUTOCOMPLETE_VERSION_CHECK=0)
+class AutocompleteTest(LittleLemonTestCase):
+    url = "/api/menu-items/autocomplete"
+
+    def titles(self, query: str) -> list[str]:
+        response = self.client.get(self.url, {"q": query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [result["title"] for result in response.data]
+
+    def test_word_prefixes(self):
+        """Any word of a menu item or category title can match"""
+        self.assertEqual(self.titles("b"), ["Beef Pasta", "Bellini", "Bruschetta"])
+        self.assertEqual(self.titles("SAL"), ["Greek Salad"])
+        self.assertEqual(self.titles("appetizer"), ["Appetizer"])
+        self.assertEqual(self.titles(""), [])
+
+    def test_own_rate_budget(self):
+        """Keystrokes don't use up the anonymous menu throttle"""
+        for query in "bruschetta":
+            self.titles(query)
+        response = self.client.get("/api/menu-items")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_menu_writes(self):
+        """Menu writes update the index once they commit"""
+        self.titles("x")
+        with self.captureOnCommitCallbacks(execute=True):
+            item = models.MenuItem.objects.create(
+                title="Lemon Sorbet",
+                price=4,
+                featured=False,
+                category=models.Category.objects.first(),
+            )
+        self.assertEqual(self.titles("sorb"), ["Lemon Sorbet"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.title = "Lime Sorbet"
+            item.save()
+        self.assertEqual(self.titles("lemon s"), [])
+        self.assertEqual(self.titles("lime"), ["Lime Sorbet"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.assertEqual(self.titles("sorb"), [])
+
+    def test_other_processes(self):
+        """A version bumped elsewhere makes the index reload"""
+        self.titles("x")
+        models.Category.objects.filter(title="Main").update(title="Mains")
+        cache.incr(autocomplete.VERSION_KEY)
+        self.assertEqual(self.titles("main"), ["Mains"])
+
+        # Checked at most every AUTOCOMPLETE_VERSION_CHECK seconds
+        models.Category.objects.filter(title="Mains").update(title="Main")
+        cache.incr(autocomplete.VERSION_KEY)
+        with self.settings(AUTOCOMPLETE_VERSION_CHECK=60):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.titles("main"), ["Mains"])
+            autocomplete.index.checked = 0.0
+            self.assertEqual(self.titles("main"), ["Main"])
+
+    def test_unchanged_titles(self):
+        """Saves that keep the title leave the index and its version alone"""
+        self.titles("x")
+        version = cache.get(autocomplete.VERSION_KEY)
+        entries = autocomplete.index.entries
+        item = models.MenuItem.objects.get(title="Bellini")
+        with self.captureOnCommitCallbacks(execute=True):
+            item.featured = True
+            item.save()
+            item.save(update_fields=["featured"])
+        self.assertIs(autocomplete.index.entries, entries)
+        self.assertEqual(cache.get(autocomplete.VERSION_KEY), version)
+
+
+class FacetsTest(LittleLemonTestCase):
+    def test_counts(self):
+        """Facet counts come from one query"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/menu-items", {"facets": "true"})
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(
+            response.data,
+            {
+                "count": 6,
+                "category": {"Main": 2, "Appetizer": 2, "Drink": 2},
+                "featured": {"true": 0, "false": 6},
+                "price_band": {"under-5": 0, "5-10": 5, "10-and-over": 1},
+            },
+        )
+
+    def test_filters(self):
+        """Facets count the items the same filters and search would list"""
+        params = {"search": "e", "price_band": "5-10", "category": "a"}
+        response = self.client.get("/api/menu-items", params)
+        titles = {item["title"] for item in response.data["results"]}
+        self.assertEqual(titles, {"Beef Pasta", "Cheese Sticks", "Greek Salad"})
+
+        response = self.client.get("/api/menu-items", {**params, "facets": "1"})
+        self.assertEqual(response.data["count"], len(titles))
+        self.assertEqual(response.data["category"], {"Main": 1, "Appetizer": 2})
+
+
+class WriteContentionTest(TransactionTestCase):
+    @override_settings(WRITE_RETRY_ATTEMPTS=3, WRITE_RETRY_BACKOFF=0)
+    def test_retries(self):
+        """Lock errors are retried, then answered with 503"""
+        calls = []
+
+        def locked(times: int):
+            calls.append(True)
+            if len(calls) <= times:
+                raise OperationalError("database is locked")
+            return "written"
+
+        self.assertEqual(writes.run_with_retries(lambda: locked(2)), "written")
+
+        calls.clear()
+        with self.assertRaises(writes.WriteContention):
+            writes.run_with_retries(lambda: locked(3))
+        self.assertEqual(len(calls), 3)
+
+    @override_settings(SQLITE_WRITER_LANE=True)
+    def test_lane_takes_writes_only(self):
+        """Views run in their own thread, and only their writes go to the lane"""
+        threads = []
+
+        @writes.retry_on_lock
+        def view():
+            threads.append(threading.current_thread().name)
+            writes.write(lambda: threads.append(threading.current_thread().name))
+
+        view()
+        self.assertEqual(threads, [threading.current_thread().name, "writer-lane"])
+
+    @override_settings(SQLITE_WRITER_LANE=True, WRITER_LANE_TIMEOUT=0.05)
+    def test_lane_timeout(self):
+        """Writes left queued behind a slow one are dropped with 503"""
+        started = threading.Event()
+        release = threading.Event()
+        busy = writes.writer_lane().submit(lambda: started.set() or release.wait(5))
+        started.wait(5)
+        written = []
+        with self.assertRaises(writes.WriteContention):
+            writes.write(lambda: written.append(True))
+        release.set()
+        busy.result()
+
+        writes.write(lambda: None)
+        self.assertEqual(written, [])
+
+    def test_stress(self):
+        """Concurrent writers all commit with retries or through the writer lane"""
+        out = io.StringIO()
+        call_command(
+            "stress_writes", threads=4, writes=10, mode=["retry", "lane"], stdout=out
+        )
+        report = out.getvalue()
+        self.assertIn("retry: 40 committed, 0 failed", report)
+        self.assertIn("lane: 40 committed, 0 failed", report)
+        # The scratch table is dropped
+        self.assertNotIn(
+            "littlelemon_stress_scratch", connection.introspection.table_names()
+        )
+
+
+class SlowQueryLogTest(LittleLemonTestCase):
+    def test_normalize(self):
+        """Statements differing only in their values share a fingerprint"""
+        self.assertEqual(
+            slowlog.normalize(
+                "SELECT * FROM t WHERE a = %s AND b IN (1, 2,\n 3) "
+                "AND c = 'x''y' LIMIT 4"
+            ),
+            "SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ? LIMIT ?",
+        )
+
+    def test_log(self):
+        """Slow statements are logged with their view and plan, then summed up"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/slow.jsonl"
+            with self.settings(
+                SLOW_QUERY_LOG=True, SLOW_QUERY_THRESHOLD=0, SLOW_QUERY_LOG_FILE=path
+            ):
+                for _ in range(2):
+                    self.client.get("/api/menu-items", {"search": "pasta"})
+
+            entries = [e for e in slowlog.read_log(path) if "LIMIT" in e["sql"]]
+            self.assertEqual(len(entries), 2)
+            entry = entries[0]
+            self.assertEqual(entry["fingerprint"], entries[1]["fingerprint"])
+            self.assertEqual(entry["view"], "menu-items")
+            self.assertNotIn("pasta", entry["sql"])
+            self.assertTrue(entry["plan"])
+
+            out = io.StringIO()
+            call_command("slow_queries", file=path, sort="count", stdout=out)
+            self.assertIn("2 runs", out.getvalue())
+            self.assertIn(entry["fingerprint"], out.getvalue())
+            self.assertIn("views: menu-items", out.getvalue())
+
+
+class MetricsTest(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        for metric in metrics.registry.metrics.values():
+            metric.values.clear()
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_endpoint(self):
+        """Requests, latencies, SQL counts and throttling are labelled by URL name"""
+        for _ in range(6):
+            self.client.get("/api/menu-items")
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        text = response.content.decode()
+
+        for line in [
+            'littlelemon_requests_total{view="menu-items",method="GET",status="200"} 5',
+            'littlelemon_requests_total{view="menu-items",method="GET",status="429"} 1',
+            'littlelemon_throttled_total{view="menu-items"} 1',
+            'littlelemon_request_duration_seconds_bucket{view="menu-items",le="+Inf"} 6',
+            'littlelemon_request_duration_seconds_count{view="menu-items"} 6',
+            'littlelemon_admission_shed_total{class="catalog"} 0',
+        ]:
+            self.assertIn(line, text.splitlines())
+        self.assertIn("# TYPE littlelemon_request_queries histogram", text)
+
+        response = self.client.get(
+            "/metrics", REMOTE_ADDR="10.0.0.1", HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_access(self):
+        """Allowed addresses still need the token or a staff user"""
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(User.objects.create(username="ops", is_staff=True))
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_exited_processes(self):
+        """Snapshots of exited processes are folded into one, without gauges"""
+        snapshot = {
+            "in_flight": metrics.gauge_family("Requests", [], [[[], 3]]),
+            "handled": metrics.counter_family("Requests", [], [[[], 5]]),
+        }
+        exited = subprocess.Popen([sys.executable, "-c", ""])
+        exited.wait()
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(METRICS_DIR=directory):
+                for pid in [os.getppid(), exited.pid]:
+                    with open(f"{directory}/{pid}.json", "w") as file:
+                        json.dump(snapshot, file)
+                families = metrics.collect()
+                self.assertEqual(
+                    sorted(os.listdir(directory)),
+                    sorted([f"{os.getppid()}.json", "exited.json", "fold.lock"]),
+                )
+                # Folded once
+                self.assertEqual(metrics.collect(), families)
+
+        self.assertEqual(families["in_flight"]["samples"], {(): 3})
+        self.assertEqual(families["handled"]["samples"], {(): 10})
+
+    def test_processes(self):
+        """Snapshots written by other processes are added up"""
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(METRICS_DIR=directory):
+                metrics.requests.inc("categories", "GET", "200", amount=2)
+                metrics.registry.flush(force=True)
+                # Another process's snapshot
+                with open(f"{directory}/{os.getppid()}.json", "w") as file:
+                    json.dump(metrics.registry.snapshot(), file)
+                text = metrics.render(metrics.collect())
+
+        self.assertIn(
+            'littlelemon_requests_total{view="categories",method="GET",status="200"} 4',
+            text.splitlines(),
+        )
+
+
+class BulkOrderUpdateTest(LittleLemonTestCase):
+    url = "/api/orders"
+
+    def authenticate(self, username):
+        token = Token.objects.get(user__username=username)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def test_crew(self):
+        """The crew sets the status of their own orders in one UPDATE"""
+        crew = User.objects.get(username="Rex")
+        buzz = User.objects.get(username=CUSTOMER["username"])
+        mine = [
+            models.Order.objects.create(user=buzz, delivery_crew=crew, total=1).id
+            for _ in range(3)
+        ]
+        other = models.Order.objects.create(user=buzz, total=1).id
+
+        self.authenticate("Rex")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch(
+                self.url, {"ids": [*mine, other, 9999], "status": True}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result["result"] for result in response.data["results"]],
+            ["updated"] * 3 + ["forbidden", "not found"],
+        )
+        updates = [q for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(models.Order.objects.filter(status=True).values_list("id", flat=True)),
+            mine,
+        )
+
+        response = self.client.patch(
+            self.url, {"ids": mine, "delivery_crew_id": crew.id}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_manager(self):
+        """Managers assign crews, one UPDATE per distinct change"""
+        buzz = User.objects.get(username=CUSTOMER["username"])
+        ids = [models.Order.objects.create(user=buzz, total=1).id for _ in range(4)]
+        rex = User.objects.get(username="Rex")
+
+        self.authenticate(MANAGER["username"])
+        response = self.client.patch(
+            self.url,
+            [
+                {"ids": ids[:2], "delivery_crew_id": rex.id},
+                {"ids": ids[2:], "status": True},
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        orders = models.Order.objects.filter(id__in=ids).order_by("id")
+        self.assertEqual(
+            [(order.delivery_crew_id, order.status) for order in orders],
+            [(rex.id, False), (rex.id, False), (None, True), (None, True)],
+        )
+
+        response = self.client.patch(
+            self.url, {"ids": ids, "delivery_crew_id": buzz.id}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_grouped_changes(self):
+        """Identical changes share an UPDATE, and an order takes one change"""
+        buzz = User.objects.get(username=CUSTOMER["username"])
+        ids = [models.Order.objects.create(user=buzz, total=1).id for _ in range(3)]
+
+        self.authenticate(MANAGER["username"])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch(
+                self.url,
+                [{"ids": ids[:1], "status": True}, {"ids": ids[1:], "status": True}],
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [q for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        delivered = models.Order.objects.filter(id__in=ids, status=True)
+        self.assertEqual(delivered.count(), 3)
+
+        response = self.client.patch(
+            self.url,
+            [{"ids": ids[:2], "status": False}, {"ids": ids[1:], "status": True}],
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["ids"], [ids[1]])
+
+    def test_crew_and_manager(self):
+        """Users in both groups get the crew's rules, as for a single order"""
+        rex = User.objects.get(username="Rex")
+        rex.groups.add(Group.objects.get(name="Manager"))
+        buzz = User.objects.get(username=CUSTOMER["username"])
+        order = models.Order.objects.create(user=buzz, delivery_crew=rex, total=1)
+
+        self.authenticate("Rex")
+        response = self.client.patch(
+            self.url, {"ids": [order.id], "delivery_crew_id": rex.id}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class HomeTest(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        models.MenuItem.objects.filter(title="Bellini").update(featured=True)
+
+    def test_sections(self):
+        """The home screen has the same data as the separate endpoints"""
+        response = self.client.get("/api/home")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["categories"], self.client.get("/api/categories").data
+        )
+        self.assertEqual(
+            response.data["featured"],
+            self.client.get("/api/menu-items", {"featured": True}).data["results"],
+        )
+        self.assertEqual(
+            response.data["cart"],
+            self.client.get("/api/cart/menu-items").data["results"],
+        )
+        self.assertEqual(
+            response.data["orders"], self.client.get("/api/orders").data["results"]
+        )
+
+    def test_catalog_cache(self):
+        """The shared parts are cached until the menu changes"""
+        self.client.get("/api/home")
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get("/api/home")
+        # Token, groups, cart and orders
+        self.assertEqual(len(ctx.captured_queries), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Category.objects.create(title="Soup", slug="soup")
+        titles = [c["title"] for c in self.client.get("/api/home").data["categories"]]
+        self.assertIn("Soup", titles)
+
+    def test_catalog_price_changes(self):
+        """Price adjustments invalidate the cache, though they send no signals"""
+        bellini = models.MenuItem.objects.filter(title="Bellini")
+        bellini.update(featured=True)
+        [featured] = self.client.get("/api/home").data["featured"]
+        self.assertEqual(featured["price"], "5.00")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bellini.adjust_price(2)
+        [featured] = self.client.get("/api/home").data["featured"]
+        self.assertEqual(featured["price"], "10.00")
+
+
+class IdempotencyTest(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def test_replay(self):
+        """A retried checkout gets the first response and places no order"""
+        orders = models.Order.objects.count()
+        first = self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="checkout-1")
+        with self.assertNumQueries(2):
+            retry = self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="checkout-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(models.Order.objects.count(), orders + 1)
+
+        # A new key is a new request, and the cart is now empty
+        response = self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="checkout-2")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_different_request(self):
+        """Keys can't be reused for another body, and failures aren't kept"""
+        data = {"menuitem_id": 3, "quantity": 1, "unit_price": "5.00"}
+        response = self.client.post(
+            "/api/cart/menu-items", data, HTTP_IDEMPOTENCY_KEY="a"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(
+            "/api/cart/menu-items", {**data, "quantity": 2}, HTTP_IDEMPOTENCY_KEY="a"
+        )
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        response = self.client.post(
+            "/api/cart/menu-items", {"quantity": 1}, HTTP_IDEMPOTENCY_KEY="b"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(models.IdempotencyKey.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT=0)
+    def test_in_progress(self):
+        """A retry of a request still in progress is told to come back"""
+        buzz = User.objects.get(username=CUSTOMER["username"])
+        models.IdempotencyKey.objects.create(
+            key=idempotency.digest(buzz.id, "POST", "/api/orders", "k"),
+            fingerprint=idempotency.digest("{}"),
+            expires=dt.datetime.now(dt.timezone.utc) + dt.timedelta(minutes=1),
+        )
+        response = self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="k")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+    def test_purge(self):
+        self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="k")
+        self.assertEqual(idempotency.purge(), 0)
+        models.IdempotencyKey.objects.update(
+            expires=dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds=1)
+        )
+        self.assertEqual(idempotency.purge(), 1)
+
+
+class ConcurrentIdempotencyTest(TransactionTestCase):
+    def test_duplicates_wait(self):
+        """Concurrent duplicates wait for the first and share its response"""
+        calls = []
+
+        @api_view(["POST"])
+        @idempotency.idempotent
+        def view(request):
+            calls.append(True)
+            time.sleep(0.2)
+            return Response({"number": len(calls)}, status=status.HTTP_201_CREATED)
+
+        factory = APIRequestFactory()
+        responses = []
+
+        def send():
+            request = factory.post("/", {}, HTTP_IDEMPOTENCY_KEY="k")
+            responses.append(view(request))
+            connection.close()
+
+        threads = [threading.Thread(target=send) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.data for r in responses], [{"number": 1}] * 4)
+        self.assertEqual(
+            sum(r.headers.get("Idempotent-Replayed") == "true" for r in responses), 3
+        )
+
+
+class InventoryTest(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        token = Token.objects.get(user__username=CUSTOMER["username"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def available(self, id: int):
+        return self.client.get(f"/api/menu-items/{id}").data["available"]
+
+    def test_checkout(self):
+        """Checkout takes from the day's stock and shows what is left"""
+        models.MenuItem.objects.filter(id=1).update(daily_limit=3)
+        self.assertEqual(self.available(1), 3)
+        self.assertIsNone(self.available(2))
+
+        response = self.client.post("/api/orders")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.available(1), 1)
+        items = self.client.get("/api/menu-items").data["results"]
+        self.assertEqual([item["available"] for item in items[:2]], [1, None])
+
+        data = {"menuitem_id": 1, "quantity": 2, "unit_price": "6.00"}
+        response = self.client.post("/api/cart/menu-items", data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_sold_out(self):
+        """A checkout with a sold out item takes nothing"""
+        models.MenuItem.objects.filter(id__in=[1, 2]).update(daily_limit=2)
+        inventory.take(models.MenuItem.objects.get(id=2), 1)
+        orders = models.Order.objects.count()
+
+        response = self.client.post("/api/orders")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(models.Order.objects.count(), orders)
+        self.assertEqual([self.available(1), self.available(2)], [2, 1])
+
+    def test_failed_checkout(self):
+        """A checkout failing after taking stock gives it back"""
+        models.MenuItem.objects.filter(id=1).update(daily_limit=3)
+        with mock.patch("LittleLemonAPI.views.enqueue", side_effect=ValueError):
+            response = self.client.post("/api/orders")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.available(1), 3)
+
+    def test_consolidate(self):
+        """Stock left is spread evenly again and past days are dropped"""
+        menuitem = models.MenuItem.objects.get(id=1)
+        menuitem.daily_limit = 10
+        yesterday = localdate() - dt.timedelta(days=1)
+        inventory.create_shards(menuitem, yesterday)
+        with override_settings(INVENTORY_SHARDS=3):
+            inventory.take(menuitem, 5)
+            self.assertEqual(inventory.consolidate(), 1)
+            self.assertEqual(inventory.consolidate(), 0)
+
+        shards = models.StockShard.objects.order_by("shard")
+        self.assertEqual(list(shards.values_list("remaining", flat=True)), [2, 2, 1])
+        self.assertFalse(shards.filter(date=yesterday).exists())
+
+
+class InventoryStressTest(TransactionTestCase):
+    @override_settings(WRITE_RETRY_ATTEMPTS=20)
+    def test_no_overselling(self):
+        """Concurrent checkouts never take more than the daily limit"""
+        category = models.Category.objects.create(title="Main", slug="main")
+        menuitem = models.MenuItem.objects.create(
+            title="Bruschetta",
+            price=5,
+            featured=False,
+            category=category,
+            daily_limit=20,
+        )
+        wanted = {}
+        for number in range(12):
+            user = User.objects.create(username=f"customer{number}")
+            wanted[user.id] = random.randint(1, 3)
+            models.Cart.objects.create(
+                user=user,
+                menuitem=menuitem,
+                quantity=wanted[user.id],
+                unit_price=menuitem.price,
+            )
+        responses = {}
+
+        def checkout(user_id: int):
+            client = APIClient()
+            client.force_authenticate(User.objects.get(id=user_id))
+            responses[user_id] = client.post("/api/orders").status_code
+            connection.close()
+
+        threads = [threading.Thread(target=checkout, args=[id]) for id in wanted]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        sold = {
+            order.user_id: order.orderitem_set.get().quantity
+            for order in models.Order.objects.prefetch_related("orderitem_set")
+        }
+        remaining = sum(models.StockShard.objects.values_list("remaining", flat=True))
+        self.assertEqual(sum(sold.values()) + remaining, 20)
+        self.assertTrue(all(wanted[user_id] == sold[user_id] for user_id in sold))
+        rejected = [id for id, code in responses.items() if code == 409]
+        self.assertTrue(rejected)
+        self.assertEqual(len(sold) + len(rejected), len(wanted))
+        # Only checkouts asking for more than was left were turned down, and
+        # they keep their cart
+        self.assertTrue(all(wanted[user_id] > remaining for user_id in rejected))
+        self.assertEqual(
+            set(models.Cart.objects.values_list("user_id", flat=True)), set(rejected)
+        )
+
+    def test_first_checkout_of_the_day(self):
+        """The day's first checkout doesn't try every shard before creating them"""
+        category = models.Category.objects.create(title="Main", slug="main")
+        menuitem = models.MenuItem.objects.create(
+            title="Bruschetta",
+            price=5,
+            featured=False,
+            category=category,
+            daily_limit=8,
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            inventory.take(menuitem, 1)
+        updates = [q for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+        # One attempt on a missing shard, then the one taken from
+        self.assertEqual(len(updates), 2)
@@ -3,29 +3,41 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
+    path("home", views.home, name="home"),
     path("categories", views.categories, name="categories"),
-    path("cart/menu-items", views.CartView.as_view()),
-    path("groups/delivery-crew/users", views.DeliveryCrewView.as_view()),
+    path("cart/menu-items", views.CartView.as_view(), name="cart"),
+    path(
+        "groups/delivery-crew/users",
+        views.DeliveryCrewView.as_view(),
+        name="delivery-crew",
+    ),
     path(
         "groups/delivery-crew/users/<str:username>",
         views.SingleDeliveryCrewView.as_view(),
+        name="delivery-crew-member",
     ),
-    path("groups/manager/users", views.ManagerView.as_view()),
+    path("groups/manager/users", views.ManagerView.as_view(), name="managers"),
     path(
         "groups/manager/users/<str:username>",
         views.SingleManagerView.as_view(),
+        name="manager",
     ),
-    path("menu-items/featured/<int:pk>", views.item_of_day),
+    path("menu-items/featured/<int:pk>", views.item_of_day, name="item-of-day"),
     path("menu-items", views.MenuItemsView.as_view(), name="menu-items"),
-    path("menu-items/<int:pk>", views.SingleMenuItemView.as_view()),
+    path("menu-items/autocomplete", views.menu_autocomplete, name="autocomplete"),
+    path(
+        "menu-items/<int:pk>", views.SingleMenuItemView.as_view(), name="menu-item"
+    ),
     path(
         "orders",
         views.OrderView.as_view(
             {
                 "get": "list",
                 "post": "create",
+                "patch": "bulk_update",
             }
         ),
+        name="orders",
     ),
     path(
         "orders/<int:orderId>",
@@ -37,5 +49,7 @@ urlpatterns = [
                 "delete": "destroy",
             }
         ),
+        name="order",
     ),
+    path("admission", views.admission, name="admission"),
 ]
@@ -1,40 +1,67 @@
+import hmac
+
+from django.conf import settings
 from django.contrib.auth.models import Group, User
+from django.db.models import Prefetch, QuerySet
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from rest_framework import generics, status, viewsets
 from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.filters import SearchFilter
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 
-from . import filters
-from .models import Cart, Category, MenuItem, Order, OrderItem
+from . import autocomplete, catalog, filters, inventory, metrics
+from .admission import get_admission
+from .carts import get_cart_store
+from .coalesce import coalesce
+from .idempotency import idempotent
+from .jobs import enqueue
+from .models import (
+    ArchivedOrder,
+    ArchivedOrderItem,
+    Category,
+    MenuItem,
+    Order,
+    OrderItem,
+)
 from .permissions import IsManager, is_delivery_crew, is_manager
 from .serializers import (
+    BulkOrderUpdateSerializer,
     CartSerializer,
     CategorySerializer,
+    ExpandedOrderSerializer,
     MenuItemSerializer,
     OrderItemSerializer,
+    OrderLineSerializer,
     OrderSerializer,
     UserSerializer,
+    split_param,
 )
+from .tasks import send_receipt
+from .writes import retry_on_lock, write
 
 
 @api_view(["GET", "POST"])
 @throttle_classes([AnonRateThrottle, UserRateThrottle])
 def categories(request):
     if request.method == "GET":
-        items = Category.objects.all()
-        serialized_items = CategorySerializer(items, many=True)
-        return Response(serialized_items.data, status=status.HTTP_200_OK)
+        data = coalesce(
+            request.build_absolute_uri(),
+            lambda: CategorySerializer(Category.objects.all(), many=True).data,
+        )
+        return Response(data, status=status.HTTP_200_OK)
     else:
         if not is_manager(request):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         try:
             serialized = CategorySerializer(
                 data=dict(
-                    slug=request.POST.get("slug"),
-                    title=request.POST.get("title"),
+                    slug=request.data.get("slug"),
+                    title=request.data.get("title"),
                 )
             )
             if serialized.is_valid(raise_exception=True):
@@ -46,29 +73,92 @@ def categories(request):
 
 @api_view(["POST"])
 @permission_classes([IsManager])
+@idempotent
+@retry_on_lock
 def item_of_day(request, pk: int):
-    # Set item to featured
     item = get_object_or_404(MenuItem, id=pk)
-    item.featured = True
-    item.save()
 
-    # Undo any other featured
-    try:
+    def feature():
+        # Set item to featured
+        item.featured = True
+        item.save()
+
+        # Undo any other featured
         items = MenuItem.objects.filter(featured=True).exclude(id=pk)
-        for item in items:
+        for other in items:
             serialized = MenuItemSerializer(
-                item,
+                other,
                 data={"featured": False},
                 partial=True,
             )
             if serialized.is_valid(raise_exception=True):
-                item.save()
+                other.save()
+
+    try:
+        write(feature)
         return Response(status=status.HTTP_201_CREATED)
     except Exception as e:
-        return Response({"message": e}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 
+class AutocompleteRateThrottle(UserRateThrottle):
+    """Search-as-you-type gets its own budget, per user or per IP address"""
 
-class MenuItemsView(generics.ListCreateAPIView):
+    scope = "autocomplete"
+
+
+@api_view(["GET"])
+@throttle_classes([AutocompleteRateThrottle])
+def menu_autocomplete(request):
+    """Menu items and categories with a word starting with `?q=`"""
+    try:
+        limit = min(int(request.query_params.get("limit", 10)), 50)
+    except ValueError:
+        return Response(
+            {"message": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(autocomplete.index.search(request.query_params.get("q", ""), limit))
+
+
+@api_view(["GET"])
+@permission_classes([IsManager])
+def admission(request):
+    """Concurrency, queue depth and shed counts per admission class"""
+    return Response(get_admission().snapshot())
+
+
+def is_metrics_scraper(request) -> bool:
+    """Staff users, or requests with the METRICS_TOKEN bearer token"""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_staff:
+        return True
+    token = getattr(settings, "METRICS_TOKEN", None)
+    header = request.headers.get("Authorization", "")
+    return bool(token) and hmac.compare_digest(header, f"Bearer {token}")
+
+
+def metrics_view(request):
+    """Metrics of all worker processes in the Prometheus text format"""
+    allowed = getattr(settings, "METRICS_ALLOWED_IPS", None)
+    if allowed and request.META.get("REMOTE_ADDR") not in allowed:
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    # Behind a reverse proxy every request comes from an allowed address
+    if not is_metrics_scraper(request):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+class SparseFieldsViewMixin:
+    """Limits the queryset to the fields requested with `?fields=`/`?omit=`"""
+
+    def get_queryset(self):
+        return self.get_serializer().prune_queryset(super().get_queryset())
+
+
+class MenuItemsView(SparseFieldsViewMixin, generics.ListCreateAPIView):
     queryset = MenuItem.objects.select_related("category").order_by("id")
     serializer_class = MenuItemSerializer
     ordering_fields = ["title", "price", "category__title"]
@@ -82,9 +172,41 @@ class MenuItemsView(generics.ListCreateAPIView):
             permission_classes = [IsManager]
         return [permission() for permission in permission_classes]
 
+    def wants_facets(self) -> bool:
+        return self.request.query_params.get("facets", "").lower() in ["1", "true"]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # One lookup of the day's stock per limited item, in the same query
+        if not self.wants_facets() and "available" in self.get_serializer().fields:
+            queryset = queryset.with_availability()
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if self.wants_facets():
+            return self.facets(request)
+
+        # The menu is the same for everyone, so concurrent identical requests
+        # share one query and serialization
+        data = coalesce(
+            request.build_absolute_uri(),
+            lambda: super(MenuItemsView, self).list(request, *args, **kwargs).data,
+        )
+        return Response(data)
+
+    def facets(self, request):
+        """Counts for the menu items matching the current filters and search"""
+        data = coalesce(
+            request.build_absolute_uri(),
+            lambda: filters.facet_counts(
+                self.filter_queryset(self.get_queryset()).select_related(None)
+            ),
+        )
+        return Response(data)
+
 
 class SingleMenuItemView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = MenuItem.objects.all()
+    queryset = MenuItem.objects.with_availability()
     serializer_class = MenuItemSerializer
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
 
@@ -110,7 +232,7 @@ class ManagerView(generics.ListCreateAPIView):
         try:
             user = get_object_or_404(
                 self.get_queryset(),
-                username=request.POST.get("username"),
+                username=request.data.get("username"),
             )
             group = get_object_or_404(Group, name="Manager")
             user.groups.add(group)
@@ -120,7 +242,7 @@ class ManagerView(generics.ListCreateAPIView):
             )
         except Exception as e:
             return Response(
-                {"message": e, "post": request.POST}, status=status.HTTP_400_BAD_REQUEST
+                {"message": e, "post": request.data}, status=status.HTTP_400_BAD_REQUEST
             )
 
 
@@ -150,7 +272,7 @@ class DeliveryCrewView(generics.ListCreateAPIView):
 
     def post(self, request, *args, **kwargs):
         try:
-            user = get_object_or_404(User, username=request.POST.get("username"))
+            user = get_object_or_404(User, username=request.data.get("username"))
             group = get_object_or_404(Group, name="Delivery Crew")
             user.groups.add(group)
             return Response(
@@ -180,7 +302,9 @@ class SingleDeliveryCrewView(generics.DestroyAPIView):
             return Response({"message": e}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CartView(generics.ListCreateAPIView):
+@method_decorator(idempotent, name="create")
+@method_decorator(retry_on_lock, name="create")
+class CartView(SparseFieldsViewMixin, generics.ListCreateAPIView):
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
     ordering_fields = ["user", "menuitem", "price"]
@@ -188,19 +312,73 @@ class CartView(generics.ListCreateAPIView):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
 
     def get_queryset(self):
-        return (
-            Cart.objects.select_related("menuitem")
-            .filter(user__username=self.request.user)
-            .order_by("id")
+        return get_cart_store(self.request.user).items()
+
+    def filter_queryset(self, queryset):
+        # Only carts kept in the database can be searched and ordered
+        if isinstance(queryset, QuerySet):
+            return super().filter_queryset(queryset)
+        return queryset
+
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        # Stock is only taken at checkout, but sold out items can't be added
+        inventory.check(data["menuitem_id"], data["quantity"])
+        store = get_cart_store(self.request.user)
+        serializer.instance = write(
+            lambda: store.add(data["menuitem_id"], data["quantity"], data["unit_price"])
         )
 
+    @idempotent
+    @retry_on_lock
     def delete(self, request, *args, **kwargs):
         try:
-            for object in self.get_queryset():
-                object.delete()
+            write(get_cart_store(request.user).clear)
             return Response(status=status.HTTP_200_OK)
         except Exception as e:
-            return Response({"message": e}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@throttle_classes([AnonRateThrottle, UserRateThrottle])
+def home(request):
+    """
+    Everything the app shows when it opens, in one request: the categories,
+    the featured menu items, the cart and the first page of orders.
+    """
+    orders = visible_orders(
+        request, Order.objects.select_related("user", "delivery_crew").order_by("id")
+    )
+    context = {"request": request}
+    return Response(
+        {
+            "categories": catalog.categories(),
+            "featured": catalog.featured_items(),
+            "cart": CartSerializer(
+                get_cart_store(request.user).items(), many=True, context=context
+            ).data,
+            "orders": OrderSerializer(
+                orders[: api_settings.PAGE_SIZE], many=True, context=context
+            ).data,
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+def wants_archive(request) -> bool:
+    """Archived orders are only read when asked for with `?archived=true`"""
+    return request.query_params.get("archived", "").lower() in ["1", "true"]
+
+
+def visible_orders(request, queryset):
+    """All orders for managers, assigned ones for the crew, else the user's own"""
+    if is_manager(request):
+        return queryset.all()
+    elif is_delivery_crew(request):
+        return queryset.filter(delivery_crew__username=request.user)
+    else:
+        return queryset.filter(user__username=request.user)
 
 
 class OrderView(viewsets.ModelViewSet):
@@ -209,17 +387,36 @@ class OrderView(viewsets.ModelViewSet):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
 
     def get_queryset(self, request, *args, **kwargs):
-        return Order.objects.select_related("user").order_by("id")
+        model = ArchivedOrder if wants_archive(request) else Order
+        return model.objects.select_related("user", "delivery_crew").order_by("id")
 
-    def list(self, request):
-        queryset = self.get_queryset(request)
+    def get_serializer_class(self):
+        if "items" in split_param(self.request.query_params.get("expand")):
+            return ExpandedOrderSerializer
+        return self.serializer_class
 
-        if is_manager(request):
-            queryset = queryset.all()
-        elif is_delivery_crew(request):
-            queryset = queryset.filter(delivery_crew__username=request.user)
-        else:
-            queryset = queryset.filter(user__username=request.user)
+    def list(self, request):
+        queryset = visible_orders(request, self.get_queryset(request))
+
+        serializer = self.get_serializer()
+        queryset = serializer.prune_queryset(queryset)
+        if "items" in serializer.fields:
+            # One query for the items of the whole page, whatever its size
+            item_model = ArchivedOrderItem if wants_archive(request) else OrderItem
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    "orderitem_set",
+                    queryset=item_model.objects.only(
+                        "order",
+                        "menuitem",
+                        "title",
+                        "category_title",
+                        "quantity",
+                        "unit_price",
+                        "price",
+                    ).order_by("id"),
+                )
+            )
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -229,13 +426,16 @@ class OrderView(viewsets.ModelViewSet):
             serialized = self.get_serializer(queryset, many=True)
             return Response(serialized.data, status=status.HTTP_200_OK)
 
+    @idempotent
+    @retry_on_lock
     def create(self, request):
         try:
             user = get_object_or_404(User, username=request.user)
-            cart = Cart.objects.filter(user=user)
+            store = get_cart_store(user)
+            cart = list(store.items())
 
             # Make sure there are items in the cart
-            if not cart.exists():
+            if not cart:
                 return Response(
                     {"message": "No items in cart"}, status=status.HTTP_400_BAD_REQUEST
                 )
@@ -247,32 +447,138 @@ class OrderView(viewsets.ModelViewSet):
             # serialized = self.get_serializer(data)
             # serialized.save()
 
-            order = Order.objects.create(
-                user=user,
-                total=sum([item.price for item in cart]),
-            )
+            def place_order():
+                # Limited items are taken from today's stock first, all or none
+                inventory.take_all([(item.menuitem, item.quantity) for item in cart])
 
-            # Add Cart Items to OrderItem
-            for item in cart:
-                serialized = OrderItemSerializer(
-                    data=dict(
-                        order_id=order.id,
-                        menuitem_id=item.menuitem.id,
-                        quantity=item.quantity,
-                        unit_price=item.unit_price,
-                    )
+                order = Order.objects.create(
+                    user=user,
+                    total=sum([item.price for item in cart]),
                 )
-                if serialized.is_valid(raise_exception=True):
-                    serialized.save()
 
-            # Remove items from cart
-            cart = Cart.objects.filter(user__username=request.user)
-            cart.delete()
+                # Add Cart Items to OrderItem
+                for item in cart:
+                    serialized = OrderItemSerializer(
+                        data=dict(
+                            order_id=order.id,
+                            menuitem_id=item.menuitem.id,
+                            quantity=item.quantity,
+                            unit_price=item.unit_price,
+                        )
+                    )
+                    if serialized.is_valid(raise_exception=True):
+                        # Order history keeps the titles the customer saw
+                        serialized.save(
+                            title=item.menuitem.title,
+                            category_title=item.menuitem.category.title,
+                        )
+
+                # Remove items from cart
+                store.clear()
+
+                # Side effects run in the background, only if the order commits
+                enqueue(send_receipt, key=f"receipt:{order.id}", order_id=order.id)
 
+            # Nothing is kept if any step fails, including the stock taken
+            write(place_order)
             return Response(status=status.HTTP_201_CREATED)
 
+        except inventory.SoldOut:
+            raise
         except Exception as e:
-            return Response({"message": e}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    @idempotent
+    @retry_on_lock
+    def bulk_update(self, request):
+        """
+        Apply one change, or a list of changes, each to several orders:
+        `{"ids": [1, 2], "status": true}`. The delivery crew may only set the
+        status of the orders assigned to them, managers may also set the
+        delivery_crew_id of any order. An order may appear in one change only.
+        """
+        # Same precedence as SingleOrderView.update
+        if is_delivery_crew(request):
+            keys = ["status"]
+        elif is_manager(request):
+            keys = ["status", "delivery_crew_id"]
+        else:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        many = isinstance(request.data, list)
+        serialized = BulkOrderUpdateSerializer(data=request.data, many=many)
+        serialized.is_valid(raise_exception=True)
+        changes = serialized.validated_data if many else [serialized.validated_data]
+
+        for change in changes:
+            if any(key not in keys for key in change if key != "ids"):
+                return Response(
+                    {"message": f"You may only change {', '.join(keys)}"},
+                    status=status.HTTP_403_FORBIDDEN,
+                )
+
+        seen, repeated = set(), set()
+        for change in changes:
+            repeated |= seen & set(change["ids"])
+            seen |= set(change["ids"])
+        if repeated:
+            return Response(
+                {
+                    "message": "Each order may appear in one change only",
+                    "ids": sorted(repeated),
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        crew_ids = {
+            change["delivery_crew_id"]
+            for change in changes
+            if change.get("delivery_crew_id") is not None
+        }
+        if crew_ids and len(crew_ids) != (
+            User.objects.filter(id__in=crew_ids, groups__name="Delivery Crew").count()
+        ):
+            return Response(
+                {"message": "delivery_crew_id must be a delivery crew member"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # One query tells which orders exist and which this user may change
+        ids = {id for change in changes for id in change["ids"]}
+        crew_of = dict(
+            Order.objects.filter(id__in=ids).values_list("id", "delivery_crew_id")
+        )
+        allowed = {
+            id
+            for id, crew_id in crew_of.items()
+            if "delivery_crew_id" in keys or crew_id == request.user.id
+        }
+
+        # One UPDATE per distinct change, however many entries ask for it
+        targets = {}
+        for change in changes:
+            fields = tuple((key, change[key]) for key in keys if key in change)
+            group = targets.setdefault(fields, [])
+            group += [id for id in change["ids"] if id in allowed]
+
+        def apply():
+            for fields, group in targets.items():
+                if group:
+                    Order.objects.filter(id__in=group).update(**dict(fields))
+
+        write(apply)
+        results = {}
+        for change in changes:
+            for id in change["ids"]:
+                if id in allowed:
+                    results[id] = "updated"
+                elif id in crew_of:
+                    results[id] = "forbidden"
+                else:
+                    results[id] = "not found"
+
+        results = [{"id": id, "result": result} for id, result in results.items()]
+        return Response({"results": results}, status=status.HTTP_200_OK)
 
 
 class SingleOrderView(viewsets.ViewSet):
@@ -280,14 +586,15 @@ class SingleOrderView(viewsets.ViewSet):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
 
     def retrieve(self, request, orderId: int):
-        items = OrderItem.objects.filter(
-            order__user__username=request.user,
+        item_model = ArchivedOrderItem if wants_archive(request) else OrderItem
+        items = item_model.objects.filter(
+            order__user=request.user,
             order__id=orderId,
         )
         if len(items) == 0:
             return Response(status=status.HTTP_400_BAD_REQUEST)
         else:
-            serialized = OrderItemSerializer(items, many=True)
+            serialized = OrderLineSerializer(items, many=True)
             return Response(serialized.data, status=status.HTTP_200_OK)
 
     def destroy(self, request, orderId: int):
@@ -298,6 +605,8 @@ class SingleOrderView(viewsets.ViewSet):
         item.delete()
         return Response(status=status.HTTP_200_OK)
 
+    @idempotent
+    @retry_on_lock
     def update(self, request, orderId: int):
         if is_delivery_crew(request) or is_manager(request):
             if is_delivery_crew(request):
@@ -306,11 +615,13 @@ class SingleOrderView(viewsets.ViewSet):
                 keys = ["status", "delivery_crew_id"]
 
             try:
-                data = {k: v for k, v in request.POST.items() if k in keys}
+                data = {k: v for k, v in request.data.items() if k in keys}
                 order = get_object_or_404(Order, id=orderId)
                 serialized = OrderSerializer(order, data=data, partial=True)
                 if serialized.is_valid(raise_exception=True):
-                    serialized.save()
+                    write(serialized.save)
                 return Response(data=serialized.data, status=status.HTTP_200_OK)
             except Exception as e:
-                return Response({"message": e}, status=status.HTTP_400_BAD_REQUEST)
+                return Response(
+                    {"message": str(e)}, status=status.HTTP_400_BAD_REQUEST
+                )
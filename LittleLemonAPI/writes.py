@@ -0,0 +1,185 @@
+"""
+Coordination of writes to SQLite, which allows one writer at a time.
+
+Transactions start with BEGIN IMMEDIATE (the "transaction_mode" database
+option), so a writer takes the lock when it begins rather than failing when it
+upgrades a read lock halfway through. `retry_on_lock` runs a view in such a
+transaction and retries it with jittered exponential backoff while the
+database is locked, answering 503 once WRITE_RETRY_ATTEMPTS are used up.
+
+Views do their writes through `write`, in closures kept to the writes
+themselves. With SQLITE_WRITER_LANE enabled, `retry_on_lock` runs the view
+outside a transaction and these closures are handed to one writer thread per
+process, which commits up to WRITER_LANE_BATCH_SIZE of them together, so
+concurrent small writes share one lock and one sync to disk. A closure still
+queued after WRITER_LANE_TIMEOUT seconds is dropped and answered with 503.
+"""
+
+import functools
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+LOCK_ERRORS = [
+    "database is locked",
+    "database table is locked",
+    "database schema is locked",
+]
+
+
+class WriteContention(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The database is busy, please retry later"
+    default_code = "write_contention"
+    # Sent as Retry-After
+    wait = 1
+
+
+def is_lock_error(error: Exception) -> bool:
+    return isinstance(error, OperationalError) and any(
+        message in str(error) for message in LOCK_ERRORS
+    )
+
+
+def backoff(attempt: int) -> float:
+    """Seconds to wait before retrying, doubling with each attempt, with jitter"""
+    delay = getattr(settings, "WRITE_RETRY_BACKOFF", 0.01) * 2**attempt
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def run_with_retries(func):
+    """Call `func` in a transaction, retrying while the database is locked"""
+    attempts = getattr(settings, "WRITE_RETRY_ATTEMPTS", 8)
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                return func()
+        except OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            if attempt == attempts - 1:
+                raise WriteContention() from e
+            time.sleep(backoff(attempt))
+
+
+class WriterLane:
+    """A thread that commits the writes submitted to it in batches"""
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, func) -> Future:
+        future = Future()
+        self.queue.put((func, future))
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="writer-lane", daemon=True
+                )
+                self.thread.start()
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.commit(batch)
+
+    def commit(self, batch: list[tuple]):
+        outcomes = []
+
+        def write_batch():
+            outcomes.clear()
+            for func, _ in batch:
+                # A failing write only rolls back its own savepoint
+                try:
+                    with transaction.atomic():
+                        outcomes.append((func(), None))
+                except Exception as e:
+                    if is_lock_error(e):
+                        raise
+                    outcomes.append((None, e))
+
+        # Writes whose caller gave up waiting are dropped
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            run_with_retries(write_batch)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), (result, error) in zip(batch, outcomes):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_lane = None
+_lane_lock = threading.Lock()
+
+
+def writer_lane() -> WriterLane:
+    global _lane
+    with _lane_lock:
+        if _lane is None:
+            _lane = WriterLane(getattr(settings, "WRITER_LANE_BATCH_SIZE", 32))
+        return _lane
+
+
+def lane_enabled() -> bool:
+    return getattr(settings, "SQLITE_WRITER_LANE", False)
+
+
+def write(func):
+    """Run `func` as one write, in the writer lane if enabled"""
+    if connection.in_atomic_block:
+        # The enclosing transaction already holds the lock, or will retry; a
+        # savepoint keeps a failing write from leaving half its changes
+        with transaction.atomic():
+            return func()
+    if not lane_enabled():
+        return run_with_retries(func)
+
+    future = writer_lane().submit(func)
+    try:
+        return future.result(timeout=getattr(settings, "WRITER_LANE_TIMEOUT", 5))
+    except FutureTimeout:
+        if future.cancel():
+            raise WriteContention() from None
+        # Already being committed
+        return future.result()
+
+
+def retry_on_lock(view):
+    """
+    Decorate a view, or view method, that writes to the database. Its writes
+    go through `write`.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if lane_enabled() and not connection.in_atomic_block:
+            # Only the view's writes are handed to the lane
+            return view(*args, **kwargs)
+        return write(functools.partial(view, *args, **kwargs))
+
+    return wrapper